@@ -1,10 +1,12 @@
 import gymnasium as gym
 
-env = gym.make("CartPole-v1")
+import durak_env # registers Durak-v0
+
+env = gym.make('Durak-v0')
 
 observation, info = env.reset(seed=42)
 for _ in range(1000):
-    action = env.action_space.sample()
+    action = env.action_space.sample(info['action_mask'])
     observation, reward, terminated, truncated, info = env.step(action)
 
     if terminated or truncated:
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from durak import BotPlayer, GameController, Player
+
+def _ask(player, game_state, kind, idx):
+    if kind == 'attack':
+        return player.decide_attack(game_state, idx)
+    if kind == 'defense':
+        return player.decide_defense(game_state)
+    return player.decide_pickup(game_state)
+
+class AsyncPlayer(Player):
+    async def decide_attack(self, _game_state, _idx):
+        return None
+
+    async def decide_defense(self, _game_state):
+        return None
+
+    async def decide_pickup(self, _game_state):
+        return None
+
+class AsyncGameController(GameController):
+    # Awaits AsyncPlayers and calls plain Players directly. A decision that times out,
+    # is invalid or loses its connection is made by a bot instead.
+    def __init__(self, *players, timeout=30.0, **kwargs):
+        super().__init__(*players, **kwargs)
+        self.timeout = timeout
+        self.fallback = BotPlayer('Fallback')
+        self.fallbacks = 0
+
+    def use_rng(self, rng):
+        super().use_rng(rng)
+        self.fallback.rng = rng
+
+    async def play_game(self, rng=None):
+        if rng is not None:
+            self.use_rng(rng)
+        self.start_game()
+        while self.pending is not None:
+            self.apply(await self.decide_async(*self.pending))
+
+    async def decide_async(self, kind, idx):
+        player = self.players[idx]
+        if not isinstance(player, AsyncPlayer):
+            return self.decide(kind, idx)
+        try:
+            return await asyncio.wait_for(_ask(player, self.game_state, kind, idx), self.timeout)
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            self.fallbacks += 1
+            return _ask(self.fallback, self.game_state, kind, idx)
+
+class StreamPlayer(AsyncPlayer):
+    # One JSON line per decision: {"seq", "kind", "state", "moves"}. The client answers
+    # "<seq> <index into moves>"; answers to earlier, timed out prompts are skipped.
+    def __init__(self, name, reader, writer):
+        super().__init__(name)
+        self.reader = reader
+        self.writer = writer
+        self.seq = 0
+        self.connected = True
+
+    async def decide_attack(self, game_state, idx):
+        return await self.ask('attack', idx, game_state.legal_attacks(idx))
+
+    async def decide_defense(self, game_state):
+        return await self.ask('defense', game_state.defender(), game_state.legal_defenses())
+
+    async def decide_pickup(self, game_state):
+        return await self.ask('pickup', game_state.defender(), game_state.legal_pickup())
+
+    async def send(self, message):
+        self.writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+        await self.writer.drain()
+
+    async def ask(self, kind, idx, moves):
+        if not self.connected:
+            raise ConnectionError('client disconnected')
+        self.seq += 1
+        await self.send({'seq': self.seq, 'kind': kind, 'state': self.controller.get_state(idx),
+                         'moves': [str(m) for m in moves]})
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                self.connected = False
+                raise ConnectionError('client disconnected')
+            seq, _, choice = line.decode().partition(' ')
+            if int(seq) == self.seq:
+                break
+        choice = int(choice)
+        if not 0 <= choice < len(moves):
+            raise ValueError(f'move index out of range: {choice}')
+        return moves[choice]
+
+class TableServer:
+    # every connection gets its own table against bots, all on one event loop
+    def __init__(self, opponents=1, games=None, timeout=30.0):
+        self.opponents = opponents
+        self.games = games
+        self.timeout = timeout
+        self.server = None
+        self.tables = 0
+        self.games_played = 0
+        self.fallbacks = 0
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.host, host, port, backlog=4096)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def host(self, reader, writer):
+        self.tables += 1
+        player = StreamPlayer('Remote', reader, writer)
+        bots = [BotPlayer(f'Bot{i}') for i in range(self.opponents)]
+        gc = AsyncGameController(player, *bots, timeout=self.timeout)
+        played = 0
+        try:
+            while player.connected and (self.games is None or played < self.games):
+                await gc.play_game(rng=random.Random())
+                played += 1
+                await player.send({'kind': 'end', 'durak': gc.game_state.durak == 0})
+        except ConnectionError:
+            pass
+        finally:
+            self.games_played += played
+            self.fallbacks += gc.fallbacks
+            self.tables -= 1
+            writer.close()
+
+async def stand_in_client(host, port, rng, games, delay=0.0):
+    # answers every prompt with a random legal index, optionally after up to delay seconds
+    reader, writer = await asyncio.open_connection(host, port)
+    decisions = 0
+    finished = 0
+    try:
+        while finished < games:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message['kind'] == 'end':
+                finished += 1
+                continue
+            if delay:
+                await asyncio.sleep(rng.random() * delay)
+            writer.write(f'{message["seq"]} {rng.randrange(len(message["moves"]))}\n'.encode())
+            await writer.drain()
+            decisions += 1
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+    return decisions
+
+async def load_test(clients=1000, games=1, timeout=1.0, delay=0.0):
+    tables = TableServer(games=games, timeout=timeout)
+    port = await tables.start()
+    start = time.perf_counter()
+    decisions = await asyncio.gather(*(stand_in_client('127.0.0.1', port, random.Random(i),
+                                                        games, delay)
+                                       for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    await tables.close()
+    return sum(decisions), tables.games_played, tables.fallbacks, elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Host Durak tables for remote players on one event loop')
+    parser.add_argument('--serve', type=int, metavar='PORT', default=None)
+    parser.add_argument('--opponents', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--clients', type=int, default=1000, help='stand-in clients for the load test')
+    parser.add_argument('--games', type=int, default=1, help='games per stand-in client')
+    parser.add_argument('--delay', type=float, default=0.0, help='max think time per stand-in decision')
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        async def serve():
+            tables = TableServer(args.opponents, timeout=args.timeout)
+            await tables.start('0.0.0.0', args.serve)
+            await tables.server.serve_forever()
+        asyncio.run(serve())
+    else:
+        decisions, games, fallbacks, elapsed = asyncio.run(
+            load_test(args.clients, args.games, args.timeout, args.delay))
+        print(f'{args.clients} tables: {games} games, {decisions} remote decisions in {elapsed:.2f}s '
+              f'({decisions / elapsed:.0f}/s), {fallbacks} bot fallbacks')
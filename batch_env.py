@@ -0,0 +1,282 @@
+import time
+
+import numpy as np
+
+from bitboard import BEATS, NUM_CARDS, NUM_RANKS, NUM_SUITS, RANK_LOW, RANK_MASKS
+
+# actions: [0, NUM_CARDS) play/cover with a card, [NUM_CARDS, 2*NUM_CARDS) pass it on
+# with a card, then stop attacking and take
+TRANSFER = NUM_CARDS
+PASS = 2 * NUM_CARDS
+TAKE = 2 * NUM_CARDS + 1
+NUM_ACTIONS = 2 * NUM_CARDS + 2
+
+ATTACK, DEFENSE, PILE_ON = 0, 1, 2
+
+CARD_BITS = np.array([1 << i for i in range(NUM_CARDS)], dtype=np.uint64)
+BEATS_TABLE = np.array(BEATS, dtype=np.uint64)
+RANK_TABLE = np.array(RANK_MASKS, dtype=np.uint64)
+ALL_CARDS = np.uint64((1 << NUM_CARDS) - 1)
+ONE = np.uint64(1)
+
+def popcount(masks):
+    return np.bitwise_count(masks).astype(np.int64)
+
+def lowest_card(masks):
+    return popcount((masks & (~masks + ONE)) - ONE)
+
+def rank_spread(masks):
+    ranks = np.zeros_like(masks)
+    for s in range(NUM_SUITS):
+        ranks |= masks >> np.uint64(s * NUM_RANKS)
+    ranks &= np.uint64(RANK_LOW)
+    spread = np.zeros_like(masks)
+    for s in range(NUM_SUITS):
+        spread |= ranks << np.uint64(s * NUM_RANKS)
+    return spread
+
+def unpack(masks):
+    # (..., k) uint64 -> (..., k, NUM_CARDS) bits, card i at position i
+    flat = np.ascontiguousarray(masks).view(np.uint8).reshape(*masks.shape, 8)
+    return np.unpackbits(flat, axis=-1, bitorder='little')[..., :NUM_CARDS]
+
+class BatchDurakEnv:
+    def __init__(self, num_games, number_of_players=2, seed=None, max_steps=1000):
+        if 6 * number_of_players > NUM_CARDS:
+            raise ValueError(f'{NUM_CARDS} cards cannot deal {number_of_players} hands of 6')
+        self.num_games = num_games
+        self.number_of_players = number_of_players
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng(seed)
+        self.obs_size = 6 * NUM_CARDS + number_of_players + 4
+
+        n, p = num_games, number_of_players
+        self.rows = np.arange(n)
+        self.hands = np.zeros((n, p), dtype=np.uint64)
+        self.active = np.ones((n, p), dtype=bool)
+        self.deck = np.zeros((n, NUM_CARDS), dtype=np.int64)
+        self.deck_pos = np.zeros(n, dtype=np.int64)
+        self.trump = np.zeros(n, dtype=np.int64)
+        self.trump_suit = np.zeros(n, dtype=np.int64)
+        self.attacks = np.zeros(n, dtype=np.uint64)
+        self.beaten = np.zeros(n, dtype=np.uint64)
+        self.defenses = np.zeros(n, dtype=np.uint64)
+        self.discard = np.zeros(n, dtype=np.uint64)
+        self.attacker = np.zeros(n, dtype=np.int64)
+        self.defender = np.zeros(n, dtype=np.int64)
+        self.actor = np.zeros(n, dtype=np.int64)
+        self.phase = np.zeros(n, dtype=np.int64)
+        self.passes = np.zeros(n, dtype=np.int64)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.masks = np.zeros((n, NUM_ACTIONS), dtype=bool)
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self._reset_rows(self.rows)
+        self.masks = self.action_masks()
+        return self.observations(), {'action_mask': self.masks, 'actor': self.actor.copy()}
+
+    def _reset_rows(self, rows):
+        n, p = len(rows), self.number_of_players
+        deck = self.rng.random((n, NUM_CARDS)).argsort(axis=1)
+        self.deck[rows] = deck
+        self.trump[rows] = deck[:, -1]
+        self.trump_suit[rows] = deck[:, -1] // NUM_RANKS
+        hands = np.zeros((n, p), dtype=np.uint64)
+        for r in range(6):
+            for i in range(p):
+                hands[:, i] |= CARD_BITS[deck[:, r * p + i]]
+        self.hands[rows] = hands
+        self.deck_pos[rows] = 6 * p
+        self.active[rows] = True
+        for name in ('attacks', 'beaten', 'defenses', 'discard'):
+            getattr(self, name)[rows] = 0
+        self.attacker[rows] = 0
+        self.defender[rows] = 1
+        self.actor[rows] = 0
+        self.phase[rows] = ATTACK
+        self.passes[rows] = 0
+        self.steps[rows] = 0
+
+    def _next_active(self, rows, players, exclude=None):
+        found = np.full(len(rows), -1, dtype=np.int64)
+        for k in range(1, self.number_of_players + 1):
+            cand = (players + k) % self.number_of_players
+            ok = (found < 0) & self.active[rows, cand]
+            if exclude is not None:
+                ok &= cand != exclude
+            found = np.where(ok, cand, found)
+        return found
+
+    def action_masks(self):
+        rows = self.rows
+        hand = self.hands[rows, self.actor]
+        defender_hand = self.hands[rows, self.defender]
+        unbeaten = self.attacks & ~self.beaten
+        n_attacks = popcount(self.attacks)
+        cap = np.where(self.discard == 0, 5, 6)
+        attacking = self.phase != DEFENSE
+        defending = ~attacking
+
+        room = (n_attacks < cap) & (popcount(unbeaten) < popcount(defender_hand))
+        allowed = np.where(self.attacks == 0, ALL_CARDS, rank_spread(self.attacks | self.defenses))
+        plays = np.where(attacking & room, hand & allowed, 0)
+        target = np.where(unbeaten != 0, lowest_card(unbeaten), 0)
+        covers = hand & BEATS_TABLE[self.trump_suit, target]
+        plays = np.where(defending & (unbeaten != 0), covers, plays)
+
+        next_defender = self._next_active(rows, self.defender)
+        can_transfer = defending & (self.beaten == 0) & (self.attacks != 0) & (n_attacks < cap) \
+            & (popcount(self.hands[rows, next_defender]) > n_attacks)
+        transfers = np.where(can_transfer, hand & rank_spread(self.attacks), 0)
+
+        masks = np.zeros((self.num_games, NUM_ACTIONS), dtype=bool)
+        masks[:, :NUM_CARDS] = unpack(plays)
+        masks[:, TRANSFER:TRANSFER + NUM_CARDS] = unpack(transfers)
+        masks[:, PASS] = attacking & (self.attacks != 0)
+        masks[:, TAKE] = defending
+        return masks
+
+    def observations(self):
+        rows = self.rows
+        hand = self.hands[rows, self.actor]
+        trump_bits = CARD_BITS[self.trump]
+        trump_bits = np.where(self.deck_pos < NUM_CARDS, trump_bits, 0)
+        cards = np.stack([hand, self.attacks & ~self.beaten, self.beaten, self.defenses,
+                          self.discard, trump_bits], axis=1)
+        obs = np.empty((self.num_games, self.obs_size), dtype=np.float32)
+        obs[:, :6 * NUM_CARDS] = unpack(cards).reshape(self.num_games, -1)
+        seats = (self.actor[:, None] + np.arange(self.number_of_players)) % self.number_of_players
+        end = 6 * NUM_CARDS + self.number_of_players
+        obs[:, 6 * NUM_CARDS:end] = popcount(self.hands[rows[:, None], seats])
+        obs[:, end] = NUM_CARDS - self.deck_pos
+        obs[:, end + 1:end + 4] = self.phase[:, None] == np.arange(3)
+        return obs
+
+    def sample_actions(self, masks=None):
+        masks = self.masks if masks is None else masks
+        return np.argmax(self.rng.random(masks.shape) * masks, axis=1)
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int64)
+        if not self.masks[self.rows, actions].all():
+            bad = np.flatnonzero(~self.masks[self.rows, actions])
+            raise ValueError(f'illegal actions in games {bad.tolist()}')
+        self.steps += 1
+        bits = CARD_BITS[actions % NUM_CARDS]
+        attacking = self.phase != DEFENSE
+
+        rows = np.flatnonzero((actions < NUM_CARDS) & attacking)
+        if len(rows):
+            self.hands[rows, self.actor[rows]] &= ~bits[rows]
+            self.attacks[rows] |= bits[rows]
+            self.passes[rows] = 0
+            first = rows[self.phase[rows] == ATTACK]
+            self.phase[first] = DEFENSE
+            self.actor[first] = self.defender[first]
+
+        rows = np.flatnonzero((actions < NUM_CARDS) & ~attacking)
+        if len(rows):
+            unbeaten = self.attacks[rows] & ~self.beaten[rows]
+            self.hands[rows, self.defender[rows]] &= ~bits[rows]
+            self.defenses[rows] |= bits[rows]
+            self.beaten[rows] |= unbeaten & (~unbeaten + ONE)
+            done = rows[self.attacks[rows] == self.beaten[rows]]
+            self.phase[done] = ATTACK
+            self.actor[done] = self.attacker[done]
+            self.passes[done] = 0
+
+        rows = np.flatnonzero((actions >= TRANSFER) & (actions < PASS))
+        if len(rows):
+            self.hands[rows, self.defender[rows]] &= ~bits[rows]
+            self.attacks[rows] |= bits[rows]
+            self.attacker[rows] = self.defender[rows]
+            self.defender[rows] = self._next_active(rows, self.defender[rows])
+            self.actor[rows] = self.defender[rows]
+
+        rows = np.flatnonzero(actions == TAKE)
+        self.phase[rows] = PILE_ON
+        self.actor[rows] = self.attacker[rows]
+        self.passes[rows] = 0
+
+        rows = np.flatnonzero(actions == PASS)
+        if len(rows):
+            self.passes[rows] += 1
+            self.actor[rows] = self._next_active(rows, self.actor[rows], self.defender[rows])
+
+        n_attackers = self.active.sum(axis=1) - 1
+        all_beaten = (self.attacks != 0) & (self.attacks == self.beaten)
+        cap = np.where(self.discard == 0, 5, 6)
+        beat = (self.phase == ATTACK) & all_beaten & ((self.passes >= n_attackers)
+            | (self.hands[self.rows, self.defender] == 0) | (popcount(self.attacks) >= cap))
+        took = (self.phase == PILE_ON) & (self.passes >= n_attackers)
+        rows = np.flatnonzero(beat | took)
+        terminated = np.zeros(self.num_games, dtype=bool)
+        if len(rows):
+            terminated[rows] = self._end_bout(rows, took[rows])
+
+        rewards = np.zeros((self.num_games, self.number_of_players), dtype=np.float32)
+        durak = np.full(self.num_games, -1, dtype=np.int64)
+        over = np.flatnonzero(terminated)
+        if len(over):
+            losers = self.active[over]
+            has_durak = losers.any(axis=1)
+            durak[over] = np.where(has_durak, losers.argmax(axis=1), -1)
+            rewards[over] = np.where(has_durak[:, None], np.where(losers, -1.0, 1.0), 0.0)
+        truncated = ~terminated & (self.steps >= self.max_steps)
+
+        finished = np.flatnonzero(terminated | truncated)
+        if len(finished):
+            self._reset_rows(finished)
+        self.masks = self.action_masks()
+        info = {'action_mask': self.masks, 'actor': self.actor.copy(), 'durak': durak}
+        return self.observations(), rewards, terminated, truncated, info
+
+    def _draw(self, rows, players):
+        need = np.maximum(6 - popcount(self.hands[rows, players]), 0)
+        for j in range(6):
+            take = (j < need) & (self.deck_pos[rows] < NUM_CARDS)
+            pos = np.minimum(self.deck_pos[rows], NUM_CARDS - 1)
+            card_bits = CARD_BITS[self.deck[rows, pos]]
+            self.hands[rows, players] |= np.where(take, card_bits, 0)
+            self.deck_pos[rows] += take
+
+    def _end_bout(self, rows, took):
+        field = self.attacks[rows] | self.defenses[rows]
+        defender = self.defender[rows]
+        self.hands[rows[took], defender[took]] |= field[took]
+        self.discard[rows[~took]] |= field[~took]
+        self.attacks[rows] = 0
+        self.beaten[rows] = 0
+        self.defenses[rows] = 0
+
+        attacker = self.attacker[rows]
+        for k in range(self.number_of_players):
+            p = (attacker + k) % self.number_of_players
+            self._draw(rows, np.where(p == defender, attacker, p))
+        self._draw(rows, defender)
+
+        deck_empty = self.deck_pos[rows] >= NUM_CARDS
+        self.active[rows] &= (self.hands[rows] != 0) | ~deck_empty[:, None]
+        over = self.active[rows].sum(axis=1) <= 1
+
+        start = np.where(took, defender, defender - 1) % self.number_of_players
+        attacker = self._next_active(rows, start)
+        self.attacker[rows] = attacker
+        self.defender[rows] = self._next_active(rows, attacker)
+        self.actor[rows] = attacker
+        self.phase[rows] = ATTACK
+        self.passes[rows] = 0
+        return over
+
+if __name__ == '__main__':
+    env = BatchDurakEnv(4096, seed=0)
+    env.reset()
+    games = 0
+    start = time.perf_counter()
+    for _ in range(2000):
+        _, _, terminated, truncated, _ = env.step(env.sample_actions())
+        games += int(terminated.sum() + truncated.sum())
+    elapsed = time.perf_counter() - start
+    print(f'{games} games in {elapsed:.2f}s ({games / elapsed * 3600:,.0f} games/hour)')
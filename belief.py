@@ -0,0 +1,226 @@
+import heapq
+
+import numpy as np
+
+from bitboard import BEATS, INDEX, NUM_CARDS, SUIT, bits, to_mask
+from events import EventSink
+
+ALL_CARDS = (1 << NUM_CARDS) - 1
+# how much taking an attack lowers the odds that the taker held a card beating it
+TAKE_EVIDENCE = 0.5
+BALANCE_STEPS = 100
+BALANCE_TOLERANCE = 1e-4
+
+class BeliefTracker(EventSink):
+    # Where each observer thinks the cards it cannot see are, kept up to date from game events.
+    # Cards seen entering a hand stay known until played. The rest are spread over the hidden
+    # slots of the opponents and the deck by a weight per opponent and card, which starts even
+    # and drops for the cards that would have beaten an attack the opponent took. Tables are
+    # rebuilt lazily, only for observers something changed for.
+    def __init__(self, number_of_players, take_evidence=TAKE_EVIDENCE):
+        n = number_of_players
+        self.number_of_players = n
+        self.take_evidence = take_evidence
+        # known[p][j]: the cards p knows j holds; known[p][p] is p's hand
+        self.known = [[0] * n for _ in range(n)]
+        self.hand_sizes = [0] * n
+        self.public = 0
+        self.unbeaten = 0
+        self.trump = None
+        self.deck_size = 0
+        self.weights = np.ones((n, n, NUM_CARDS))
+        self.weighted = [False] * n
+        # tables[p]: a row per opponent in seat order after p, then the deck
+        self.tables = np.zeros((n, n, NUM_CARDS), dtype=np.float32)
+        self.stale = [True] * n
+        self.pools = [0] * n
+        self.hidden = [[0] * n for _ in range(n)]
+        self.rows = [None] * n
+        self.handlers = {
+            'trump': self._on_trump,
+            'deal': self._on_deal,
+            'attack': self._on_attack,
+            'defend': self._on_defend,
+            'pass': self._on_pass,
+            'beat': self._on_beat,
+            'take_back': self._on_take_back,
+            'surrender': self._on_surrender,
+            'draw': self._on_draw,
+        }
+
+    def emit(self, event, **fields):
+        handler = self.handlers.get(event)
+        if handler is not None:
+            handler(**fields)
+            self.stale = [True] * self.number_of_players
+
+    def _reveal(self, j, c):
+        for known in self.known:
+            known[j] |= 1 << c
+
+    def _leave_hand(self, j, c):
+        for known in self.known:
+            known[j] &= ~(1 << c)
+        self.hand_sizes[j] -= 1
+
+    def _enter_hand_publicly(self, j, c):
+        self._reveal(j, c)
+        self.public &= ~(1 << c)
+        self.unbeaten &= ~(1 << c)
+        self.hand_sizes[j] += 1
+
+    def _on_trump(self, card):
+        self.trump = INDEX[card]
+
+    def _on_deal(self, deck, hands):
+        n = self.number_of_players
+        self.known = [[0] * n for _ in range(n)]
+        for j, hand in enumerate(hands):
+            self.known[j][j] = to_mask(hand)
+            if self.known[j][j] >> self.trump & 1:
+                self._reveal(j, self.trump)
+        self.hand_sizes = [len(h) for h in hands]
+        self.public = 0
+        self.unbeaten = 0
+        self.deck_size = len(deck)
+        self.weights.fill(1.0)
+        self.weighted = [False] * n
+
+    def _on_attack(self, player, cards):
+        for card in cards:
+            c = INDEX[card]
+            self._leave_hand(player, c)
+            self.public |= 1 << c
+            self.unbeaten |= 1 << c
+
+    def _on_defend(self, player, attack, defense):
+        d = INDEX[defense]
+        self._leave_hand(player, d)
+        self.public |= 1 << d
+        self.unbeaten &= ~(1 << INDEX[attack])
+
+    def _on_pass(self, player, target, method, cards):
+        if method == 'show':
+            self._reveal(player, INDEX[cards])
+        else:
+            self._on_attack(player, cards)
+
+    def _on_beat(self, player):
+        self.unbeaten = 0
+
+    def _on_take_back(self, player, card):
+        self._enter_hand_publicly(player, INDEX[card])
+
+    def _on_surrender(self, player, pickup, picked_up):
+        # cards returned to their attackers came as take_back events, so what is still unbeaten
+        # is what the defender chose to take instead of beating
+        beaters = 0
+        for a in bits(self.unbeaten):
+            beaters |= BEATS[SUIT[self.trump]][a]
+        if beaters and self.take_evidence != 1:
+            columns = list(bits(beaters))
+            for p in range(self.number_of_players):
+                if p != player:
+                    self.weights[p, player, columns] *= self.take_evidence
+                    self.weighted[p] = True
+        for card in picked_up:
+            self._enter_hand_publicly(player, INDEX[card])
+        self.unbeaten = 0
+
+    def _on_draw(self, player, cards):
+        for p in range(self.number_of_players):
+            if p != player and self.weighted[p]:
+                # the new hidden cards carry no evidence, so the old weights are diluted by them
+                hidden = self.hand_sizes[player] - self.known[p][player].bit_count()
+                if hidden:
+                    row = self.weights[p, player]
+                    row *= hidden / (hidden + len(cards))
+                    row += len(cards) / (hidden + len(cards))
+                else:
+                    self.weights[p, player] = 1.0
+        for card in cards:
+            c = INDEX[card]
+            self.known[player][player] |= 1 << c
+            if c == self.trump:
+                self._reveal(player, c)
+        self.hand_sizes[player] += len(cards)
+        self.deck_size -= len(cards)
+
+    def _refresh(self, p):
+        n = self.number_of_players
+        known = self.known[p]
+        seen = self.public
+        for mask in known:
+            seen |= mask
+        if self.deck_size:
+            seen |= 1 << self.trump
+        pool = ALL_CARDS & ~seen
+        hidden = [0 if j == p else self.hand_sizes[j] - known[j].bit_count() for j in range(n)]
+        seats = [(p + i) % n for i in range(1, n)]
+
+        table = self.tables[p]
+        table.fill(0)
+        for row, j in enumerate(seats):
+            table[row, list(bits(known[j]))] = 1
+        if self.deck_size:
+            table[n - 1, self.trump] = 1
+        columns = list(bits(pool))
+        if columns:
+            targets = np.array([hidden[j] for j in seats] + [max(self.deck_size - 1, 0)],
+                               dtype=np.float64)
+            if self.weighted[p]:
+                odds = np.ones((n, len(columns)))
+                odds[:n - 1] = self.weights[p, seats][:, columns]
+                odds *= (targets > 0)[:, None]
+                # scale rows to their hidden counts and columns to one card each until both fit
+                for _ in range(BALANCE_STEPS):
+                    odds /= np.maximum(odds.sum(axis=0), 1e-12)
+                    sums = odds.sum(axis=1)
+                    if np.abs(sums - targets).max() < BALANCE_TOLERANCE:
+                        break
+                    odds *= (targets / np.maximum(sums, 1e-12))[:, None]
+            else:
+                odds = np.repeat((targets / len(columns))[:, None], len(columns), axis=1)
+            table[:, columns] = odds
+        self.pools[p] = pool
+        self.hidden[p] = hidden
+        self.rows[p] = None
+        self.stale[p] = False
+
+    def table(self, observer):
+        # P(card is in the opponent's hand / the deck) from observer's point of view
+        if self.stale[observer]:
+            self._refresh(observer)
+        return self.tables[observer]
+
+    def observation(self, observer):
+        # the opponents' rows flattened, to sit next to an ObservationEncoder row
+        return self.table(observer)[:self.number_of_players - 1].reshape(-1)
+
+    def sample(self, observer, rng):
+        # A deal consistent with everything observer knows, as bitboard hands and a deck with the
+        # trump first. Opponents in random order fill their hidden slots from what is left, each
+        # card keyed rng.random() ** (1 / probability) so the likeliest cards tend to win.
+        n = self.number_of_players
+        table = self.table(observer)
+        if self.rows[observer] is None:
+            self.rows[observer] = table.tolist()
+        rows = self.rows[observer]
+        hidden = self.hidden[observer]
+        hands = list(self.known[observer])
+        left = list(bits(self.pools[observer]))
+        seats = [j for j in range(n) if hidden[j]]
+        rng.shuffle(seats)
+        for j in seats:
+            row = rows[(j - observer) % n - 1]
+            drawn = heapq.nlargest(hidden[j], left,
+                                   key=lambda c: rng.random() ** (1 / max(row[c], 1e-9)))
+            dealt = 0
+            for c in drawn:
+                dealt |= 1 << c
+            hands[j] |= dealt
+            left = [c for c in left if not dealt >> c & 1]
+        rng.shuffle(left)
+        if self.deck_size:
+            left.insert(0, self.trump)
+        return hands, left
@@ -0,0 +1,165 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from durak import BotPlayer, GameController, RuleSet
+
+DECKS = {16: RuleSet(), 36: RuleSet(36), 52: RuleSet(52)}
+
+def collect_positions(number_of_players, rules, games=20, seed=0):
+    # controllers forked off pinned-seed bot games at every decision point
+    positions = []
+    for game in range(games):
+        players = [BotPlayer(f'Bot{i}') for i in range(number_of_players)]
+        gc = GameController(*players, rules=rules)
+        gc.use_rng(random.Random(seed + game))
+        gc.start_game()
+        while gc.pending is not None:
+            positions.append(gc.fork(gc.game_state.clone(), players))
+            gc.apply(gc.decide(*gc.pending))
+    return positions
+
+def time_calls(calls, setup=None, repeat=5, min_time=0.5):
+    # best-of-repeat nanoseconds per call; setup builds fresh arguments outside the timed region
+    best = None
+    for _ in range(repeat):
+        elapsed = 0.0
+        ops = 0
+        while elapsed < min_time / repeat:
+            args = setup() if setup is not None else calls
+            start = time.perf_counter()
+            for fn, arg in args:
+                fn(*arg)
+            elapsed += time.perf_counter() - start
+            ops += len(args)
+        per_op = elapsed / ops * 1e9
+        best = per_op if best is None else min(best, per_op)
+    return best
+
+def micro_benchmarks(size, number_of_players, seed=0, repeat=5):
+    results = {}
+    positions = collect_positions(number_of_players, DECKS[size], seed=seed)
+    attacks, defenses, pickups = [], [], []
+    for gc in positions:
+        kind, idx = gc.pending
+        gs = gc.game_state
+        if kind == 'attack':
+            attacks.append((gs.legal_attacks, (idx,)))
+        elif kind == 'defense':
+            defenses.append((gs.legal_defenses, ()))
+        else:
+            pickups.append((gs.legal_pickup, ()))
+    pairs = []
+    for gc in positions:
+        gs = gc.game_state
+        if gc.pending[0] == 'defense' and gs.durak is None:
+            for a, d in gs.field.items():
+                if d is None:
+                    pairs.extend((gs.can_beat, (a, c)) for c in gs.hands[gs.defender()])
+    states = [(gc.get_state, (gc.pending[1],)) for gc in positions]
+    drawing = [gc.game_state for gc in positions if gc.game_state.deck.has_cards()]
+    fielded = [gc.game_state for gc in positions
+               if gc.game_state.field and gc.game_state.durak is None]
+
+    def draws():
+        return [(gs.clone().draw_cards, ()) for gs in drawing]
+
+    def round_ends():
+        # beat() is a whole round transition: discard, draw for everyone, outs, next attacker
+        return [(gs.clone().beat, ()) for gs in fielded]
+
+    suite = {
+        'legal_attacks': (attacks, None),
+        'legal_defenses': (defenses, None),
+        'legal_pickup': (pickups, None),
+        'can_beat': (pairs, None),
+        'get_state': (states, None),
+        'draw_cards': (drawing, draws),
+        'round_transition': (fielded, round_ends),
+    }
+    for name, (calls, setup) in suite.items():
+        if calls:
+            key = f'micro/{name}/{size}cards/{number_of_players}p'
+            results[key] = time_calls(calls, setup, repeat)
+    return results
+
+def games_per_second(size, number_of_players, games=200, seed=0, repeat=5):
+    # best of repeat runs over the same seeds, after one untimed warm-up run
+    players = [BotPlayer(f'Bot{i}') for i in range(number_of_players)]
+    gc = GameController(*players, rules=DECKS[size])
+    best = None
+    for run in range(repeat + 1):
+        start = time.perf_counter()
+        for game in range(games):
+            gc.play_game(rng=random.Random(seed + game))
+        elapsed = time.perf_counter() - start
+        if run:
+            best = elapsed if best is None else min(best, elapsed)
+    return games / best
+
+def macro_benchmarks(games=200, seed=0, repeat=5):
+    results = {}
+    for size in DECKS:
+        for n in range(2, 7):
+            if DECKS[size].max_hand_size * n > size:
+                continue
+            # reported as ns per game so that, like the micro numbers, lower is better
+            rate = games_per_second(size, n, games, seed, repeat)
+            results[f'macro/games/{size}cards/{n}p'] = 1e9 / rate
+    return results
+
+def run_benchmarks(seed=0, games=200, repeat=5, micro=True, macro=True):
+    results = {}
+    if micro:
+        results.update(micro_benchmarks(16, 2, seed, repeat))
+        results.update(micro_benchmarks(36, 4, seed, repeat))
+        results.update(micro_benchmarks(52, 6, seed, repeat))
+    if macro:
+        results.update(macro_benchmarks(games, seed, repeat))
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'seed': seed,
+        'results': results,
+    }
+
+def compare(results, baseline, threshold=0.10):
+    regressions = []
+    for name, value in results['results'].items():
+        before = baseline['results'].get(name)
+        if before and value > before * (1 + threshold):
+            regressions.append((name, before, value))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark engine hot paths and full games')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', choices=['micro', 'macro'], default=None)
+    parser.add_argument('--output', default=None, help='write results as JSON')
+    parser.add_argument('--baseline', default=None, help='JSON results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.seed, args.games, args.repeat,
+                            micro=args.only != 'macro', macro=args.only != 'micro')
+    for name, value in report['results'].items():
+        if name.startswith('macro/'):
+            print(f'{name:40} {1e9 / value:10.1f} games/s')
+        else:
+            print(f'{name:40} {value:10.0f} ns/op')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for name, before, after in regressions:
+            print(f'REGRESSION {name}: {before:.0f} -> {after:.0f} ns ({after / before - 1:+.1%})')
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,471 @@
+import random
+
+from durak import AttackTable, Card, default_rules
+from events import NULL_SINK
+
+NUM_RANKS = len(Card.ranks)
+NUM_SUITS = len(Card.suits)
+NUM_CARDS = NUM_RANKS * NUM_SUITS
+
+# card index = suit * NUM_RANKS + rank, so ascending ints sort like Card.__lt__
+CARDS = [Card(rank, suit) for suit in Card.suits for rank in Card.ranks]
+INDEX = {card: i for i, card in enumerate(CARDS)}
+RANK = [i % NUM_RANKS for i in range(NUM_CARDS)]
+SUIT = [i // NUM_RANKS for i in range(NUM_CARDS)]
+
+RANK_LOW = (1 << NUM_RANKS) - 1
+RANK_MASKS = [sum(1 << (s * NUM_RANKS + r) for s in range(NUM_SUITS)) for r in range(NUM_RANKS)]
+SUIT_MASKS = [RANK_LOW << (s * NUM_RANKS) for s in range(NUM_SUITS)]
+
+def _beaters(attack, trump_suit):
+    mask = 0
+    for d in range(NUM_CARDS):
+        if SUIT[d] == SUIT[attack]:
+            if RANK[d] > RANK[attack]:
+                mask |= 1 << d
+        elif SUIT[d] == trump_suit:
+            mask |= 1 << d
+    return mask
+
+# BEATS[trump_suit][attack] = mask of every card that beats attack
+BEATS = [[_beaters(a, t) for a in range(NUM_CARDS)] for t in range(NUM_SUITS)]
+
+def bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def submasks(mask):
+    sub = mask
+    while sub:
+        yield sub
+        sub = (sub - 1) & mask
+
+def rank_spread(mask):
+    ranks = 0
+    for s in range(NUM_SUITS):
+        ranks |= mask >> (s * NUM_RANKS)
+    ranks &= RANK_LOW
+    spread = 0
+    for s in range(NUM_SUITS):
+        spread |= ranks << (s * NUM_RANKS)
+    return spread
+
+def to_mask(cards):
+    mask = 0
+    for card in cards:
+        mask |= 1 << INDEX[card]
+    return mask
+
+def to_cards(mask):
+    return [CARDS[i] for i in bits(mask)]
+
+def _build_attacks(legal, field):
+    combinations = []
+    for r in range(NUM_RANKS):
+        combinations.extend(submasks(legal & RANK_MASKS[r]))
+    if field:
+        combinations.append(None)
+    return tuple(combinations)
+
+ATTACKS = AttackTable(_build_attacks)
+
+def check_rules(rules):
+    # every table here, and everything keyed on INDEX, is built for the deck Card.ranks gave
+    if rules.cards != CARDS:
+        raise ValueError(f'bitboard tables are built for {NUM_CARDS} cards, not {rules.deck_size}')
+
+class BitGameState:
+    def __init__(self, number_of_players, events=NULL_SINK, rules=None):
+        if rules is not None:
+            check_rules(rules)
+        self.number_of_players = number_of_players
+        self.events = events
+        self.rules = rules if rules is not None else default_rules()
+        self.rng = random
+        self.discard = 0
+        self.deck = []
+        self.revealed = [None] * NUM_CARDS
+        self.trump = None
+        self.trump_suit = None
+        self.beats = None
+
+        self.primary_attacker = number_of_players
+        self.attacks = 0
+        self.defenses = 0
+        self.beaten = 0
+        self.cover = [None] * NUM_CARDS
+        self.out = []
+        self.out_mask = 0
+        self.durak = None
+
+        self.hands = []
+        self.history = None
+
+    def clone(self):
+        gs = BitGameState.__new__(BitGameState)
+        gs.__dict__.update(self.__dict__)
+        gs.events = NULL_SINK
+        gs.deck = self.deck.copy()
+        gs.revealed = self.revealed.copy()
+        gs.cover = self.cover.copy()
+        gs.out = self.out.copy()
+        gs.hands = self.hands.copy()
+        gs.history = None
+        return gs
+
+    def enable_undo(self):
+        self.history = []
+
+    def _checkpoint(self, cards, deck=False):
+        self.history.append((self.hands.copy(), self.attacks, self.defenses, self.beaten,
+                             self.discard, self.primary_attacker, self.durak, len(self.out),
+                             self.out_mask, [(c, self.revealed[c], self.cover[c]) for c in cards],
+                             self.deck.copy() if deck else None))
+
+    def undo(self):
+        (self.hands, self.attacks, self.defenses, self.beaten, self.discard, self.primary_attacker,
+         self.durak, out, self.out_mask, cards, deck) = self.history.pop()
+        del self.out[out:]
+        for c, where, cover in cards:
+            self.revealed[c] = where
+            self.cover[c] = cover
+        if deck is not None:
+            self.deck = deck
+
+    def reset(self):
+        if self.history is not None:
+            self.history = []
+        self.discard = 0
+        self.deck = list(range(NUM_CARDS))
+        self.rng.shuffle(self.deck)
+        self.revealed = [None] * NUM_CARDS
+        self.trump = self.deck.pop()
+        self.deck.insert(0, self.trump)
+        self.revealed[self.trump] = -1
+        self.trump_suit = SUIT[self.trump]
+        self.beats = BEATS[self.trump_suit]
+        self.events.emit('trump', card=CARDS[self.trump])
+
+        self.primary_attacker = 0
+        self.attacks = 0
+        self.defenses = 0
+        self.beaten = 0
+        self.cover = [None] * NUM_CARDS
+        self.out = []
+        self.out_mask = 0
+        self.durak = None
+
+        self.hands = [0] * self.number_of_players
+        for _ in range(self.rules.max_hand_size):
+            for i in range(self.number_of_players):
+                self.hands[i] |= 1 << self.deck.pop()
+        if self.events is not NULL_SINK:
+            self.events.emit('deal', deck=[CARDS[c] for c in self.deck],
+                             hands=[to_cards(hand) for hand in self.hands])
+
+    @property
+    def field(self):
+        return {CARDS[a]: None if self.cover[a] is None else CARDS[self.cover[a]]
+                for a in bits(self.attacks)}
+
+    def next_after(self, player_idx):
+        if len(self.out) == self.number_of_players:
+            return self.number_of_players
+        na = (player_idx + 1) % self.number_of_players
+        while self.out_mask >> na & 1:
+            na = (na + 1) % self.number_of_players
+        return na
+
+    def defender(self):
+        return self.next_after(self.primary_attacker)
+
+    def legal_attacks(self, player_idx):
+        legal = self.hands[player_idx]
+        if self.attacks:
+            legal &= rank_spread(self.attacks | self.defenses)
+        return list(ATTACKS.get((legal, self.attacks != 0)))
+
+    def defense_cap(self):
+        discard_cap = self.rules.bout_caps[self.discard != 0]
+        return min(discard_cap - self.beaten.bit_count(), (self.attacks & ~self.beaten).bit_count())
+
+    def _iter_matchings(self, unbeaten, hand, cap, chosen):
+        if not unbeaten or len(chosen) >= cap:
+            return
+        low = unbeaten & -unbeaten
+        a = low.bit_length() - 1
+        rest = unbeaten ^ low
+        for d in bits(self.beats[a] & hand):
+            chosen.append((a, d))
+            yield chosen.copy()
+            yield from self._iter_matchings(rest, hand & ~(1 << d), cap, chosen)
+            chosen.pop()
+        yield from self._iter_matchings(rest, hand, cap, chosen)
+
+    def _count_matchings(self, unbeaten, hand, cap, memo):
+        if not unbeaten or cap <= 0:
+            return 0
+        key = (unbeaten, hand, cap)
+        if key not in memo:
+            low = unbeaten & -unbeaten
+            rest = unbeaten ^ low
+            total = self._count_matchings(rest, hand, cap, memo)
+            for d in bits(self.beats[low.bit_length() - 1] & hand):
+                total += 1 + self._count_matchings(rest, hand & ~(1 << d), cap - 1, memo)
+            memo[key] = total
+        return memo[key]
+
+    def _matching_at(self, unbeaten, hand, cap, index, memo):
+        chosen = []
+        while unbeaten:
+            low = unbeaten & -unbeaten
+            a = low.bit_length() - 1
+            unbeaten ^= low
+            for d in bits(self.beats[a] & hand):
+                if index == 0:
+                    chosen.append((a, d))
+                    return chosen
+                index -= 1
+                below = self._count_matchings(unbeaten, hand & ~(1 << d), cap - 1, memo)
+                if index < below:
+                    chosen.append((a, d))
+                    hand &= ~(1 << d)
+                    cap -= 1
+                    break
+                index -= below
+        raise IndexError(f'defense index out of range: {index}')
+
+    def passable_cards(self):
+        if not self.rules.pass_it_on or not self.attacks or self.beaten:
+            return 0
+        rank = RANK[(self.attacks & -self.attacks).bit_length() - 1]
+        return self.hands[self.defender()] & RANK_MASKS[rank]
+
+    def legal_defenses(self):
+        return list(self.iter_legal_defenses())
+
+    def iter_legal_defenses(self):
+        if self.durak is not None:
+            yield 'take'
+            return
+
+        hand = self.hands[self.defender()]
+        unbeaten = self.attacks & ~self.beaten
+        yield from self._iter_matchings(unbeaten, hand, self.defense_cap(), [])
+
+        yield None
+        if unbeaten:
+            yield 'take'
+
+        cards = self.passable_cards()
+        for sub in submasks(cards):
+            yield 'play', sub
+        trump_card = cards & SUIT_MASKS[self.trump_suit]
+        if trump_card:
+            yield 'show', trump_card.bit_length() - 1
+
+    def count_legal_defenses(self):
+        if self.durak is not None:
+            return 1
+        hand = self.hands[self.defender()]
+        unbeaten = self.attacks & ~self.beaten
+        count = self._count_matchings(unbeaten, hand, self.defense_cap(), {}) + 1
+        if unbeaten:
+            count += 1
+        cards = self.passable_cards()
+        count += (1 << cards.bit_count()) - 1
+        if cards & SUIT_MASKS[self.trump_suit]:
+            count += 1
+        return count
+
+    def legal_defense_at(self, index):
+        if self.durak is not None:
+            return 'take'
+
+        hand = self.hands[self.defender()]
+        unbeaten = self.attacks & ~self.beaten
+        cap = self.defense_cap()
+        memo = {}
+        matchings = self._count_matchings(unbeaten, hand, cap, memo)
+        if index < matchings:
+            return self._matching_at(unbeaten, hand, cap, index, memo)
+        index -= matchings
+
+        if index == 0:
+            return None
+        index -= 1
+        if unbeaten:
+            if index == 0:
+                return 'take'
+            index -= 1
+
+        cards = self.passable_cards()
+        for sub in submasks(cards):
+            if index == 0:
+                return 'play', sub
+            index -= 1
+        trump_card = cards & SUIT_MASKS[self.trump_suit]
+        if trump_card and index == 0:
+            return 'show', trump_card.bit_length() - 1
+        raise IndexError(f'defense index out of range: {index}')
+
+    def legal_pickup(self):
+        discard_cap = self.rules.bout_caps[self.discard != 0]
+        unbeaten = self.attacks & ~self.beaten
+        num_pickup = min(discard_cap - self.beaten.bit_count(), unbeaten.bit_count(),
+                         self.hands[self.defender()].bit_count())
+        if num_pickup == 0:
+            return [0]
+        return [sub for sub in submasks(unbeaten) if sub.bit_count() == num_pickup]
+
+    def can_beat(self, attack, defense):
+        return self.beats[attack] >> defense & 1 == 1
+
+    def attack(self, player_idx, cards):
+        if self.history is not None:
+            self._checkpoint(bits(cards))
+        for card in bits(cards):
+            self.revealed[card] = player_idx
+        self.hands[player_idx] &= ~cards
+        self.attacks |= cards
+        if self.events is not NULL_SINK:
+            self.events.emit('attack', player=player_idx, cards=to_cards(cards))
+        if not self.deck and not self.hands[player_idx]:
+            self.check_outs()
+
+    def defend(self, attack_card, defense_card):
+        if self.history is not None:
+            self._checkpoint((attack_card, defense_card))
+        defender = self.defender()
+        if self.events is not NULL_SINK:
+            self.events.emit('defend', player=defender, attack=CARDS[attack_card],
+                             defense=CARDS[defense_card])
+        self.revealed[defense_card] = defender
+        self.cover[attack_card] = defense_card
+        self.beaten |= 1 << attack_card
+        self.defenses |= 1 << defense_card
+        self.hands[defender] &= ~(1 << defense_card)
+
+    def pass_it_on(self, method, cards):
+        if self.history is not None:
+            self._checkpoint((cards,) if method == 'show' else bits(cards))
+        defender = self.defender()
+        if self.events is not NULL_SINK:
+            self.events.emit('pass', player=defender, target=self.next_after(defender),
+                             method=method,
+                             cards=CARDS[cards] if method == 'show' else to_cards(cards))
+        if method == 'show':
+            self.revealed[cards] = defender
+        else:
+            for card in bits(cards):
+                self.revealed[card] = defender
+            self.hands[defender] &= ~cards
+            self.attacks |= cards
+        self.primary_attacker = defender
+
+    def _clear_field(self):
+        for a in bits(self.beaten):
+            self.cover[a] = None
+        self.attacks = 0
+        self.defenses = 0
+        self.beaten = 0
+
+    def beat(self):
+        if self.history is not None:
+            self._checkpoint(bits(self.attacks | self.defenses), deck=True)
+        self.events.emit('beat', player=self.defender())
+        field = self.attacks | self.defenses
+        for card in bits(field):
+            self.revealed[card] = -2
+        self.discard |= field
+        self._clear_field()
+
+        self.draw_cards()
+        self.check_outs()
+
+        self.primary_attacker = self.next_after(self.primary_attacker)
+
+    def surrender(self, pickup):
+        if self.history is not None:
+            self._checkpoint(bits(self.attacks | self.defenses), deck=True)
+        defender = self.defender()
+        before = self.hands[defender]
+        for a in bits(self.attacks):
+            d = self.cover[a]
+            if self.revealed[a] == defender:
+                self.hands[defender] |= 1 << a
+                if d is not None:
+                    self.revealed[d] = defender
+                    self.hands[defender] |= 1 << d
+            elif pickup >> a & 1:
+                self.revealed[a] = defender
+                self.hands[defender] |= 1 << a
+            elif d is not None:
+                self.revealed[a] = defender
+                self.revealed[d] = defender
+                self.hands[defender] |= 1 << a | 1 << d
+            else:
+                self.hands[self.revealed[a]] |= 1 << a
+                if self.events is not NULL_SINK:
+                    self.events.emit('take_back', player=self.revealed[a], card=CARDS[a])
+        if self.events is not NULL_SINK:
+            self.events.emit('surrender', player=defender, pickup=to_cards(pickup),
+                             picked_up=to_cards(self.hands[defender] & ~before))
+        self._clear_field()
+
+        self.draw_cards()
+        self.check_outs()
+
+        self.primary_attacker = self.next_after(defender)
+
+    def _draw_to(self, p):
+        before = self.hands[p]
+        while self.deck and self.hands[p].bit_count() < self.rules.max_hand_size:
+            self.hands[p] |= 1 << self.deck.pop()
+        if self.events is not NULL_SINK and self.hands[p] != before:
+            self.events.emit('draw', player=p, cards=to_cards(self.hands[p] & ~before))
+
+    def draw_cards(self):
+        if self.deck:
+            defender = self.defender()
+            self._draw_to(self.primary_attacker)
+            p = self.next_after(defender)
+            while p != self.primary_attacker:
+                self._draw_to(p)
+                p = self.next_after(p)
+            self._draw_to(defender)
+
+    def check_outs(self):
+        if self.deck:
+            return
+        for i, hand in enumerate(self.hands):
+            if not self.out_mask >> i & 1 and not hand:
+                self.out.append(i)
+                self.out_mask |= 1 << i
+                if len(self.out) + 1 == self.number_of_players:
+                    for j in range(self.number_of_players):
+                        if not self.out_mask >> j & 1:
+                            self.durak = j
+                            return
+
+def _card_index(card):
+    return card if isinstance(card, int) else INDEX[card]
+
+def _card_mask(cards):
+    return cards if isinstance(cards, int) else to_mask(cards)
+
+def move_key(move, kind):
+    if move is None:
+        return (0,)
+    if isinstance(move, str):
+        return (1,)
+    if isinstance(move, tuple):
+        method, cards = move
+        if method == 'show':
+            return (2, _card_index(cards))
+        return (3, _card_mask(cards))
+    if kind == 'defense':
+        return (4, tuple(sorted((_card_index(a), _card_index(d)) for a, d in move)))
+    return (5, _card_mask(move))
@@ -0,0 +1,201 @@
+from bitboard import NUM_RANKS, RANK_LOW, bits
+from durak import SUIT_ORDER, Card
+
+# Non-trump suits are interchangeable, so every position has up to 6 suit-swapped twins. A
+# SuitPermutation sends the trump to suit 0 and the other suits to 1.. ordered by where their
+# cards lie, which gives all twins the same canonical form. Suits are indices into Card.suits.
+
+class SuitPermutation:
+    def __init__(self, order):
+        # order[suit] is the canonical suit
+        self.order = tuple(order)
+        self.indices = [self.order[i // NUM_RANKS] * NUM_RANKS + i % NUM_RANKS
+                        for i in range(NUM_RANKS * len(self.order))]
+        self.cards = {}
+        self._inverse = None
+
+    def inverse(self):
+        if self._inverse is None:
+            order = [0] * len(self.order)
+            for suit, canonical in enumerate(self.order):
+                order[canonical] = suit
+            self._inverse = permutation(order)
+        return self._inverse
+
+    def card(self, card):
+        mapped = self.cards.get(card)
+        if mapped is None:
+            suit = Card.suits[self.order[SUIT_ORDER[card.suit]]]
+            mapped = self.cards[card] = Card(card.rank, suit)
+        return mapped
+
+    def card_tuple(self, card):
+        # get_state's (rank, suit) cards
+        return None if card is None else (card[0], self.order[card[1]])
+
+    def index(self, index):
+        return self.indices[index]
+
+    def mask(self, mask):
+        mapped = 0
+        for suit, canonical in enumerate(self.order):
+            mapped |= (mask >> suit * NUM_RANKS & RANK_LOW) << canonical * NUM_RANKS
+        return mapped
+
+    def move(self, move):
+        # any GameState move: None, 'take', ('show', card), ('play', cards), defense pairs or cards
+        if move is None or isinstance(move, str):
+            return move
+        if isinstance(move, tuple):
+            method, cards = move
+            if method == 'show':
+                return method, self.card(cards)
+            return method, [self.card(c) for c in cards]
+        if move and isinstance(move[0], tuple):
+            return [(self.card(a), self.card(d)) for a, d in move]
+        return [self.card(c) for c in move]
+
+    def move_key(self, key):
+        # keys from bitboard.move_key, which work for GameState and BitGameState moves alike
+        tag = key[0]
+        if tag == 2:
+            return tag, self.indices[key[1]]
+        if tag == 3 or tag == 5:
+            return tag, self.mask(key[1])
+        if tag == 4:
+            return tag, tuple(sorted((self.indices[a], self.indices[d]) for a, d in key[1]))
+        return key
+
+_permutations = {}
+
+def permutation(order):
+    order = tuple(order)
+    perm = _permutations.get(order)
+    if perm is None:
+        perm = _permutations[order] = SuitPermutation(order)
+    return perm
+
+def _order_suits(trump_suit, signatures):
+    others = sorted((signatures[s], s) for s in range(len(Card.suits)) if s != trump_suit)
+    order = [0] * len(Card.suits)
+    for canonical, (_, suit) in enumerate(others, 1):
+        order[suit] = canonical
+    return permutation(order)
+
+def canonical_permutation(trump_suit, placements):
+    # placements: (suit, rank, where) for the cards that matter, where is any sortable tuple
+    signatures = [[] for _ in Card.suits]
+    for suit, rank, where in placements:
+        signatures[suit].append((rank, where))
+    return _order_suits(trump_suit, [sorted(signature) for signature in signatures])
+
+def mask_permutation(trump_suit, masks):
+    # the same for bitboard card sets: a suit's signature is its ranks in each mask
+    return _order_suits(trump_suit, [tuple(m >> s * NUM_RANKS & RANK_LOW for m in masks)
+                                     for s in range(len(Card.suits))])
+
+def _known(where):
+    return -2 if where is None else where
+
+def _cover(rank, suit, trump_suit):
+    # a non-trump suit's attacks are covered within the suit or by a trump, so the rank and
+    # whether it is a trump pin down the covering card
+    return (-1, False) if rank is None else (rank, suit == trump_suit)
+
+def game_state_permutation(game_state):
+    gs = game_state
+    revealed = gs.deck.revealed
+    rank_order = gs.rules.rank_order
+    trump_suit = SUIT_ORDER[gs.trump.suit]
+
+    def placements():
+        for j, hand in enumerate(gs.hands):
+            for c in hand:
+                yield c, (0, j, _known(revealed.get(c)))
+        for a, d in gs.field.items():
+            if d is None:
+                yield a, (1, _known(revealed.get(a)), _cover(None, None, trump_suit))
+            else:
+                yield a, (1, _known(revealed.get(a)),
+                          _cover(rank_order[d.rank], SUIT_ORDER[d.suit], trump_suit))
+                yield d, (2, _known(revealed.get(d)))
+        for c in gs.discard:
+            yield c, (3,)
+        for pos, c in enumerate(gs.deck.remaining()):
+            yield c, (4, pos)
+
+    return canonical_permutation(trump_suit,
+                                 ((SUIT_ORDER[c.suit], rank_order[c.rank], where)
+                                  for c, where in placements()))
+
+def bit_state_permutation(game_state):
+    gs = game_state
+
+    def placements():
+        for j, hand in enumerate(gs.hands):
+            for c in bits(hand):
+                yield c, (0, j, _known(gs.revealed[c]))
+        for c in bits(gs.attacks):
+            d = gs.cover[c]
+            yield c, (1, _known(gs.revealed[c]),
+                      _cover(None if d is None else d % NUM_RANKS,
+                             None if d is None else d // NUM_RANKS, gs.trump_suit))
+        for c in bits(gs.defenses):
+            yield c, (2, _known(gs.revealed[c]))
+        for c in bits(gs.discard):
+            yield c, (3,)
+        for pos, c in enumerate(gs.deck):
+            yield c, (4, pos)
+
+    return canonical_permutation(gs.trump_suit, ((c // NUM_RANKS, c % NUM_RANKS, where)
+                                                 for c, where in placements()))
+
+def observation_permutation(state, trump_suit):
+    # get_state drops the trump card once the deck is empty, so the trump suit is passed in
+    def placements():
+        for c in state['own_cards']:
+            yield c, (0,)
+        for (a, a_owner), defense in state['field_cards']:
+            if defense is None:
+                yield a, (1, a_owner, _cover(None, None, trump_suit))
+            else:
+                (rank, suit), d_owner = defense
+                yield a, (1, a_owner, _cover(rank, suit, trump_suit))
+                yield defense[0], (2, d_owner)
+        for rel, hand in enumerate(state['opponent_cards'], 1):
+            for c in hand:
+                if c is not None:
+                    yield c, (3, rel)
+        for c in state['discarded_cards']:
+            yield c, (4,)
+        if state['trump_card'] is not None:
+            yield state['trump_card'], (5,)
+
+    return canonical_permutation(trump_suit, ((c[1], c[0], where) for c, where in placements()))
+
+def canonical_game_state(game_state):
+    # a suit-permuted clone and the permutation; perm.inverse().move() maps its moves back
+    perm = game_state_permutation(game_state)
+    card = perm.card
+    gs = game_state.clone()
+    gs.hands = [[card(c) for c in hand] for hand in gs.hands]
+    gs.field = {card(a): None if d is None else card(d) for a, d in gs.field.items()}
+    gs.discard = [card(c) for c in gs.discard]
+    gs.deck.cards = [card(c) for c in gs.deck.cards]
+    gs.deck.revealed = {card(c): where for c, where in gs.deck.revealed.items()}
+    gs.deck.trump = gs.trump = card(gs.trump)
+    return gs, perm
+
+def canonical_observation(state, trump_suit):
+    perm = observation_permutation(state, trump_suit)
+    card = perm.card_tuple
+    canonical = dict(state)
+    canonical['own_cards'] = [card(c) for c in state['own_cards']]
+    canonical['field_cards'] = [((card(a), a_owner),
+                                 None if defense is None else (card(defense[0]), defense[1]))
+                                for (a, a_owner), defense in state['field_cards']]
+    canonical['opponent_cards'] = [[card(c) for c in hand] for hand in state['opponent_cards']]
+    canonical['discarded_cards'] = [card(c) for c in state['discarded_cards']]
+    canonical['trump_card'] = card(state['trump_card'])
+    canonical['unknown_cards'] = [card(c) for c in state['unknown_cards']]
+    return canonical, perm
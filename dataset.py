@@ -0,0 +1,35 @@
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from durak_env import action_index, encode_observation, env_observation_size
+from replay import ReplayReader
+
+NO_ACTION = -1
+
+class ReplayDataset(IterableDataset):
+    # (observation, action, outcome) for every recorded decision, encoded as Durak-v0 sees
+    # them. Moves outside the Durak-v0 action table get NO_ACTION. Games are split across
+    # DataLoader workers, each of which maps the file itself.
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        reader = ReplayReader(self.path)
+        info = get_worker_info()
+        start, step = (0, 1) if info is None else (info.id, info.num_workers)
+        try:
+            for game in range(start, len(reader), step):
+                durak = reader.header(game)['durak']
+                size = None
+                for gc, kind, player, move in reader.replay(game, observe=True):
+                    if size is None:
+                        size = env_observation_size(len(gc.players))
+                    observation = np.empty(size, dtype=np.float32)
+                    encode_observation(gc, player, kind, observation)
+                    action = action_index(gc.game_state, kind, move)
+                    yield (torch.from_numpy(observation),
+                           torch.tensor(NO_ACTION if action is None else action),
+                           torch.tensor(-1.0 if player == durak else 1.0))
+        finally:
+            reader.close()
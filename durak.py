@@ -1,8 +1,12 @@
+from collections import OrderedDict
 from dataclasses import dataclass, field
 import itertools
+import math
 import random
 import os
 
+from events import NULL_SINK, PrintSink, TeeSink
+
 class UserIntelligenceError(Exception):
     def __init__(self, message=None):
         if message:
@@ -18,21 +22,80 @@ class Card:
 
     ranks = ['6', '7', '8', '9']#, 'T', 'J', 'Q', 'K', 'A']
     suits = ['S', 'C', 'H', 'D']
+    all_ranks = ['2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A']
 
     def __post_init__(self):
-        if self.rank not in Card.ranks or self.suit not in Card.suits:
+        if self.rank not in Card.all_ranks or self.suit not in Card.suits:
             raise ValueError(f"Invalid card: {self}")
+        # cards key most of the engine's dicts and sets, so hash a precomputed int
+        object.__setattr__(self, '_hash', SUIT_ORDER[self.suit] * len(Card.all_ranks)
+                           + RANK_ORDER[self.rank])
+
+    def __hash__(self):
+        return self._hash
 
     def __lt__(self, other):
-        if Card.suits.index(self.suit) == Card.suits.index(other.suit):
-            return Card.ranks.index(self.rank) < Card.ranks.index(other.rank)
-        return Card.suits.index(self.suit) < Card.suits.index(other.suit)
+        if self.suit == other.suit:
+            return RANK_ORDER[self.rank] < RANK_ORDER[other.rank]
+        return SUIT_ORDER[self.suit] < SUIT_ORDER[other.suit]
 
     def __repr__(self):
         return f'{self.rank}{self.suit}'
 
-    def tuple(self):
-        return Card.ranks.index(self.rank), Card.suits.index(self.suit)
+    def tuple(self, rules=None):
+        return (rules if rules is not None else default_rules()).tuples[self]
+
+RANK_ORDER = {rank: i for i, rank in enumerate(Card.all_ranks)}
+SUIT_ORDER = {suit: i for i, suit in enumerate(Card.suits)}
+DECK_RANKS = {
+    24: ['9', 'T', 'J', 'Q', 'K', 'A'],
+    36: ['6', '7', '8', '9', 'T', 'J', 'Q', 'K', 'A'],
+    52: Card.all_ranks,
+}
+
+@dataclass
+class RuleSet:
+    # deck_size None plays with Card.ranks; tables are built once here and shared by every game
+    deck_size: int = None
+    pass_it_on: bool = True
+    first_bout_cap: int = 5
+    max_hand_size: int = 6
+
+    def __post_init__(self):
+        if self.deck_size is None:
+            self.ranks = list(Card.ranks)
+            self.deck_size = len(self.ranks) * len(Card.suits)
+        elif self.deck_size in DECK_RANKS:
+            self.ranks = DECK_RANKS[self.deck_size]
+        else:
+            raise ValueError(f'unsupported deck size: {self.deck_size}')
+        self.cards = [Card(rank, suit) for suit in Card.suits for rank in self.ranks]
+        self.rank_order = {rank: i for i, rank in enumerate(self.ranks)}
+        self.tuples = {c: (self.rank_order[c.rank], SUIT_ORDER[c.suit]) for c in self.cards}
+        # beats[trump suit][hash(attack)]: a mask over the hashes of the cards that beat attack
+        size = len(Card.suits) * len(Card.all_ranks)
+        self.beats = {trump: [0] * size for trump in Card.suits}
+        for trump, row in self.beats.items():
+            for a in self.cards:
+                for d in self.cards:
+                    if self._beats(a, d, trump):
+                        row[a._hash] |= 1 << d._hash
+        # most cards a bout can hold, before and after the first discard
+        self.bout_caps = (self.first_bout_cap, self.max_hand_size)
+
+    def _beats(self, attack, defense, trump):
+        if defense.suit == attack.suit:
+            return self.rank_order[defense.rank] > self.rank_order[attack.rank]
+        return defense.suit == trump
+
+_default_rules = {}
+
+def default_rules():
+    # keyed on Card.ranks so that swapping the default deck gets matching tables
+    key = tuple(Card.ranks)
+    if key not in _default_rules:
+        _default_rules[key] = RuleSet()
+    return _default_rules[key]
 
 
 @dataclass
@@ -40,26 +103,95 @@ class Deck:
     revealed: dict[Card, int] = field(default_factory=dict)
     cards: list[Card] = field(default_factory=list)
     trump: Card = None
+    rng: random.Random = field(default=random, repr=False, compare=False)
+    # cards is never changed after the shuffle, drawing only moves this cursor down
+    left: int = field(default=0, init=False, repr=False)
 
     def __post_init__(self):
-        self.cards = [Card(rank, suit) for suit in Card.suits for rank in Card.ranks]
-        random.shuffle(self.cards)
+        if not self.cards:
+            self.cards = [Card(rank, suit) for suit in Card.suits for rank in Card.ranks]
+        self.rng.shuffle(self.cards)
+        self.left = len(self.cards)
 
     def choose_trump(self):
-        self.trump = self.cards.pop()
-        self.cards.insert(0, self.trump)
+        # the last card is turned up and drawn last, after cards[:left - 1] from the top down
+        self.trump = self.cards[-1]
         self.revealed[self.trump] = -1
-        print(f'The chosen trump is: {self.trump}')
 
     def pop(self):
-        return self.cards.pop()
+        if not self.left:
+            raise IndexError('pop from empty deck')
+        self.left -= 1
+        return self.cards[self.left - 1] if self.left else self.cards[-1]
 
     def has_cards(self):
-        return len(self.cards) > 0
+        return self.left > 0
+
+    def remaining(self):
+        # the undrawn cards, trump first and the next card to draw last
+        return self.cards[-1:] + self.cards[:self.left - 1] if self.left else []
+
+    def clone(self):
+        deck = Deck.__new__(Deck)
+        deck.revealed = self.revealed.copy()
+        deck.cards = self.cards
+        deck.trump = self.trump
+        deck.rng = self.rng
+        deck.left = self.left
+        return deck
+
+_MISSING = object()
+
+class AttackTable:
+    # LRU memo of legal attack lists keyed by the playable cards and whether the field is open;
+    # the cached move lists are shared between callers and must not be mutated
+    def __init__(self, build, max_entries=1 << 16):
+        self.build = build
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        moves = self.entries.get(key)
+        if moves is None:
+            moves = self.entries[key] = self.build(*key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return moves
+
+    def __len__(self):
+        return len(self.entries)
+
+def _build_attacks(legal_cards, field):
+    legal_cards = sorted(legal_cards)
+    combinations = [[card] for card in legal_cards]
+
+    rank_groups = {}
+    for card in legal_cards:
+        if card.rank not in rank_groups:
+            rank_groups[card.rank] = []
+        rank_groups[card.rank].append(card)
+
+    for rank in Card.all_ranks:
+        cards = rank_groups.get(rank, [])
+        for i in range(2, len(cards) + 1):
+            for combo in itertools.combinations(cards, i):
+                combinations.append(list(combo))
+
+    if field:
+        combinations.append(None)
+
+    return tuple(combinations)
+
+ATTACKS = AttackTable(_build_attacks)
 
 class GameState:
-    def __init__(self, number_of_players):
+    def __init__(self, number_of_players, events=NULL_SINK, rules=None):
         self.number_of_players = number_of_players
+        self.events = events
+        self.rules = rules if rules is not None else default_rules()
+        self.rng = random
         self.primary_attacker = None
         self.discard = []
         self.deck = None
@@ -68,124 +200,245 @@ class GameState:
         self.primary_attacker = number_of_players
         self.field = {}
         self.out = []
+        self.out_mask = 0
+        self.successor = [number_of_players] * (number_of_players + 1)
         self.durak = None
 
         self.hands = []
+        self.history = None
+
+    def clone(self):
+        # copies only the mutable containers; cards are immutable and shared
+        gs = GameState.__new__(GameState)
+        gs.number_of_players = self.number_of_players
+        gs.events = NULL_SINK
+        gs.rules = self.rules
+        gs.rng = self.rng
+        gs.discard = self.discard.copy()
+        gs.deck = self.deck.clone()
+        gs.trump = self.trump
+        gs.primary_attacker = self.primary_attacker
+        gs.field = self.field.copy()
+        gs.out = self.out.copy()
+        gs.out_mask = self.out_mask
+        gs.successor = self.successor.copy()
+        gs.durak = self.durak
+        gs.hands = [hand.copy() for hand in self.hands]
+        gs.history = None
+        return gs
+
+    def enable_undo(self):
+        self.history = []
+
+    def _checkpoint(self, players, cards):
+        revealed = self.deck.revealed
+        self.history.append((self.primary_attacker, self.durak, len(self.out), len(self.discard),
+                             self.field.copy(), [(p, self.hands[p].copy()) for p in players],
+                             [(c, revealed.get(c, _MISSING)) for c in cards], self.deck.left))
+
+    def undo(self):
+        primary_attacker, durak, out, discard, field, hands, revealed, left = self.history.pop()
+        self.primary_attacker = primary_attacker
+        self.durak = durak
+        if len(self.out) > out:
+            for i in self.out[out:]:
+                self.out_mask &= ~(1 << i)
+            del self.out[out:]
+            self._link_seats()
+        del self.discard[discard:]
+        self.field = field
+        for p, hand in hands:
+            self.hands[p] = hand
+        for c, where in revealed:
+            if where is _MISSING:
+                del self.deck.revealed[c]
+            else:
+                self.deck.revealed[c] = where
+        self.deck.left = left
 
     def reset(self):
+        if self.history is not None:
+            self.history = []
         self.discard = []
-        self.deck = Deck()
+        self.deck = Deck(cards=list(self.rules.cards), rng=self.rng)
         self.deck.choose_trump()
         self.trump = self.deck.trump
+        self.events.emit('trump', card=self.trump)
 
         self.primary_attacker = 0
         self.field = {}
         self.out = []
+        self.out_mask = 0
+        self.successor = [self.number_of_players] * (self.number_of_players + 1)
+        self._link_seats()
         self.durak = None
 
         self.hands = [[] for _ in range(self.number_of_players)]
-        for _ in range(6):
+        for _ in range(self.rules.max_hand_size):
             for i, _ in enumerate(self.hands):
                 self.hands[i].append(self.deck.pop())
+        self.events.emit('deal', deck=self.deck.remaining(), hands=[h.copy() for h in self.hands])
+
+    def _link_seats(self):
+        # successor[p] is the first seat after p still in the game, or number_of_players once
+        # everyone is out; successor[number_of_players] follows seat 0 the way the modulo did
+        n = self.number_of_players
+        successor = self.successor
+        following = n
+        for _ in range(2):
+            for p in range(n - 1, -1, -1):
+                successor[p] = following
+                if not self.out_mask >> p & 1:
+                    following = p
+        successor[n] = successor[0]
 
     def next_after(self, player_idx):
-        if len(self.out) == len(self.hands):
-            return self.number_of_players
-        na = (player_idx + 1) % self.number_of_players
-        if na in self.out:
-            return self.next_after(na)
-        return na
+        return self.successor[player_idx]
 
     def defender(self):
         return self.next_after(self.primary_attacker)
 
     def legal_attacks(self, player_idx):
         if not self.field:
-            legal_cards = self.hands[player_idx].copy()
+            legal_cards = self.hands[player_idx]
         else:
             existing_ranks = {c.rank for c in self.field} | \
                             {c.rank for c in self.field.values() if c}
             legal_cards = [card for card in self.hands[player_idx] if card.rank in existing_ranks]
-
-        combinations = [[card] for card in legal_cards]
-
-        rank_groups = {}
-        for card in legal_cards:
-            if card.rank not in rank_groups:
-                rank_groups[card.rank] = []
-            rank_groups[card.rank].append(card)
-
-        for cards in rank_groups.values():
-            if len(cards) >= 2:
-                for i in range(2, len(cards) + 1):
-                    for combo in itertools.combinations(cards, i):
-                        combinations.append(sorted(combo))
-
-        if self.field:
-            combinations.append(None)
-
-        return combinations
+        return list(ATTACKS.get((frozenset(legal_cards), bool(self.field))))
 
     def legal_defenses(self):
-        if self.durak is not None:
-            return ['take']
-
-        passable_combos = []
-        if self.field and all(v is None for v in self.field.values()):
-            rank = list(self.field.keys())[0].rank
-            cards = [c for c in self.hands[self.defender()] if c.rank == rank]
-            passable = list(itertools.chain.from_iterable(
-                itertools.combinations(cards, r+1) for r in range(len(cards))))
-            for combo in passable:
-                passable_combos.append(('play', list(combo)))
-            for card in cards:
-                if card.suit == self.trump.suit:
-                    passable_combos.append(('show', card))
+        return list(self.iter_legal_defenses())
+
+    def _defense_graph(self):
+        hand = sorted(self.hands[self.defender()])
+        unbeaten = sorted(a for a, d in self.field.items() if d is None)
+        beaters = [[(1 << i, card) for i, card in enumerate(hand) if self.can_beat(a, card)]
+                   for a in unbeaten]
+        return unbeaten, beaters
+
+    def passable_cards(self):
+        if not self.rules.pass_it_on or not self.field or any(d is not None for d in self.field.values()):
+            return []
+        rank = next(iter(self.field)).rank
+        return [c for c in self.hands[self.defender()] if c.rank == rank]
+
+    def _iter_matchings(self, unbeaten, beaters, i, used, cap, chosen):
+        if i == len(unbeaten) or len(chosen) >= cap:
+            return
+        for bit, card in beaters[i]:
+            if not used & bit:
+                chosen.append((unbeaten[i], card))
+                yield chosen.copy()
+                yield from self._iter_matchings(unbeaten, beaters, i + 1, used | bit, cap, chosen)
+                chosen.pop()
+        yield from self._iter_matchings(unbeaten, beaters, i + 1, used, cap, chosen)
+
+    def _count_matchings(self, beaters, i, used, cap, memo):
+        if i == len(beaters) or cap <= 0:
+            return 0
+        key = (i, used, cap)
+        if key not in memo:
+            total = self._count_matchings(beaters, i + 1, used, cap, memo)
+            for bit, _ in beaters[i]:
+                if not used & bit:
+                    total += 1 + self._count_matchings(beaters, i + 1, used | bit, cap - 1, memo)
+            memo[key] = total
+        return memo[key]
+
+    def _matching_at(self, unbeaten, beaters, cap, index, memo):
+        chosen = []
+        used = 0
+        for i, group in enumerate(beaters):
+            for bit, card in group:
+                if used & bit:
+                    continue
+                if index == 0:
+                    chosen.append((unbeaten[i], card))
+                    return chosen
+                index -= 1
+                below = self._count_matchings(beaters, i + 1, used | bit, cap - 1, memo)
+                if index < below:
+                    chosen.append((unbeaten[i], card))
+                    used |= bit
+                    cap -= 1
                     break
+                index -= below
+        raise IndexError(f'defense index out of range: {index}')
 
-        legal_cards = []
-        for attack_card, defense_card in self.field.items():
-            if defense_card is None:
-                for card in self.hands[self.defender()]:
-                    if self.can_beat(attack_card, card):
-                        legal_cards.append((attack_card, card))
-
-        def_groups = {}
-        for a, d in legal_cards:
-            if a not in def_groups:
-                def_groups[a] = []
-            def_groups[a].append(d)
-
-        combinations = []
+    def iter_legal_defenses(self):
+        if self.durak is not None:
+            yield 'take'
+            return
 
-        for r in range(1, len(def_groups) + 1):
-            for key_subset in itertools.combinations(list(def_groups.keys()), r):
-                for values in itertools.product(*(def_groups[k] for k in key_subset)):
-                    combinations.append(list(zip(key_subset, values)))
+        unbeaten, beaters = self._defense_graph()
+        yield from self._iter_matchings(unbeaten, beaters, 0, 0, self.defense_cap(), [])
 
-        unique_combos = []
+        yield None
+        if unbeaten:
+            yield 'take'
 
-        for group in combinations:
-            n = len(group)
-            for r in range(1, n+1):
-                for subset in itertools.combinations(group, r):
-                    second_cards = [card[1] for card in subset]
-                    if len(set(second_cards)) == len(second_cards):
-                        unique_combos.append(list(subset))
+        cards = self.passable_cards()
+        for r in range(len(cards)):
+            for combo in itertools.combinations(cards, r + 1):
+                yield 'play', list(combo)
+        for card in cards:
+            if card.suit == self.trump.suit:
+                yield 'show', card
+                break
 
-        discard_cap = 6 if self.discard else 5
-        defense_cap = min(discard_cap - sum(1 for _, d in self.field.items() if d is not None), \
-                        sum(1 for _, d in self.field.items() if d is None))
-        capped_combos = [c for c in unique_combos if len(c) <= defense_cap]
+    def count_legal_defenses(self):
+        if self.durak is not None:
+            return 1
+        unbeaten, beaters = self._defense_graph()
+        count = self._count_matchings(beaters, 0, 0, self.defense_cap(), {}) + 1
+        if unbeaten:
+            count += 1
+        cards = self.passable_cards()
+        count += 2 ** len(cards) - 1
+        if any(c.suit == self.trump.suit for c in cards):
+            count += 1
+        return count
+
+    def legal_defense_at(self, index):
+        if self.durak is not None:
+            return 'take'
 
-        capped_combos.append(None)
-        if None in self.field.values():
-            capped_combos.append('take')
+        unbeaten, beaters = self._defense_graph()
+        cap = self.defense_cap()
+        memo = {}
+        matchings = self._count_matchings(beaters, 0, 0, cap, memo)
+        if index < matchings:
+            return self._matching_at(unbeaten, beaters, cap, index, memo)
+        index -= matchings
+
+        if index == 0:
+            return None
+        index -= 1
+        if unbeaten:
+            if index == 0:
+                return 'take'
+            index -= 1
+
+        cards = self.passable_cards()
+        for r in range(len(cards)):
+            n = math.comb(len(cards), r + 1)
+            if index < n:
+                return 'play', list(next(itertools.islice(
+                    itertools.combinations(cards, r + 1), index, None)))
+            index -= n
+        for card in cards:
+            if card.suit == self.trump.suit and index == 0:
+                return 'show', card
+        raise IndexError(f'defense index out of range: {index}')
 
-        return capped_combos + passable_combos
+    def defense_cap(self):
+        discard_cap = self.rules.bout_caps[bool(self.discard)]
+        return min(discard_cap - sum(1 for _, d in self.field.items() if d is not None),
+                   sum(1 for _, d in self.field.items() if d is None))
 
     def legal_pickup(self):
-        discard_cap = 6 if self.discard else 5
+        discard_cap = self.rules.bout_caps[bool(self.discard)]
         num_pickup = min([discard_cap - sum(1 for _, d in self.field.items() if d is not None),
                             sum(1 for _, d in self.field.items() if d is None),
                             len(self.hands[self.defender()])])
@@ -194,40 +447,51 @@ class GameState:
         return combos
 
     def can_beat(self, attack, defense):
-        if defense.suit == attack.suit:
-            return Card.ranks.index(defense.rank) > Card.ranks.index(attack.rank)
-        return defense.suit == self.trump.suit and attack.suit != self.trump.suit
+        return self.rules.beats[self.trump.suit][attack._hash] >> defense._hash & 1 == 1
 
     def attack(self, player_idx, cards):
+        if self.history is not None:
+            self._checkpoint([player_idx], cards)
         for card in cards:
             self.deck.revealed[card] = player_idx
             self.hands[player_idx].remove(card)
             self.field[card] = None
-        print(f'{player_idx} attacks with {cards}')
+        self.events.emit('attack', player=player_idx, cards=cards)
         if not self.deck.has_cards() and not self.hands[player_idx]:
             self.check_outs()
 
     def defend(self, attack_card, defense_card):
-        print(f'{self.defender()} defends {attack_card} with {defense_card}')
+        if self.history is not None:
+            self._checkpoint([self.defender()], [defense_card])
+        self.events.emit('defend', player=self.defender(), attack=attack_card, defense=defense_card)
         self.deck.revealed[defense_card] = self.defender()
         self.field[attack_card] = defense_card
         self.hands[self.defender()].remove(defense_card)
 
-    def pass_it_on(self, method, card):
-        print(f'{self.defender()} passes onto {self.next_after(self.defender())} by {method}ing {card}')
-        self.deck.revealed[card] = self.defender()
-        if method == 'play':
-            self.field[card] = None
-            self.hands[self.defender()].remove(card)
+    def pass_it_on(self, method, cards):
+        if self.history is not None:
+            self._checkpoint([self.defender()], [cards] if method == 'show' else cards)
+        self.events.emit('pass', player=self.defender(), target=self.next_after(self.defender()),
+                         method=method, cards=cards)
+        if method == 'show':
+            self.deck.revealed[cards] = self.defender()
+        else:
+            for card in cards:
+                self.deck.revealed[card] = self.defender()
+                self.field[card] = None
+                self.hands[self.defender()].remove(card)
         self.primary_attacker = self.defender()
 
     def beat(self):
-        print(f'{self.defender()} beat the allegations!')
+        if self.history is not None:
+            self._checkpoint(range(self.number_of_players), self._field_cards())
+        self.events.emit('beat', player=self.defender())
         for a, d in self.field.items():
             self.deck.revealed[a] = -2
-            self.deck.revealed[d] = -2
             self.discard.append(a)
-            self.discard.append(d)
+            if d is not None:
+                self.deck.revealed[d] = -2
+                self.discard.append(d)
         self.field.clear()
 
         self.draw_cards()
@@ -236,6 +500,8 @@ class GameState:
         self.primary_attacker = self.next_after(self.primary_attacker)
 
     def surrender(self, pickup):
+        if self.history is not None:
+            self._checkpoint(range(self.number_of_players), self._field_cards())
         picked_up = []
         for a, d in self.field.items():
             if self.deck.revealed[a] == self.defender():
@@ -258,8 +524,8 @@ class GameState:
                 picked_up.append(d)
             else:
                 self.hands[self.deck.revealed[a]].append(a)
-                print(f'{self.deck.revealed[a]} took back {a}')
-        print(f'{self.defender()} surrendered and picked up {picked_up}')
+                self.events.emit('take_back', player=self.deck.revealed[a], card=a)
+        self.events.emit('surrender', player=self.defender(), pickup=pickup, picked_up=picked_up)
         self.field.clear()
 
         self.draw_cards()
@@ -267,32 +533,49 @@ class GameState:
 
         self.primary_attacker = self.next_after(self.defender())
 
+    def _field_cards(self):
+        return [c for pair in self.field.items() for c in pair if c is not None]
+
+    def _draw_to(self, p):
+        hand = self.hands[p]
+        start = len(hand)
+        deck = self.deck
+        while deck.left and len(hand) < self.rules.max_hand_size:
+            hand.append(deck.pop())
+        if len(hand) > start:
+            self.events.emit('draw', player=p, cards=hand[start:])
+
     def draw_cards(self):
-        if self.deck.has_cards():
-            draw_order = [self.primary_attacker]
-            p = self.next_after(self.defender())
+        # the primary attacker, the others in seat order, the defender last
+        if self.deck.left:
+            defender = self.successor[self.primary_attacker]
+            self._draw_to(self.primary_attacker)
+            p = self.successor[defender]
             while p != self.primary_attacker:
-                draw_order.append(p)
-                p = self.next_after(p)
-            draw_order.append(self.defender())
-
-            for p in draw_order:
-                while self.deck.has_cards() and len(self.hands[p]) < 6:
-                    self.hands[p].append(self.deck.pop())
+                self._draw_to(p)
+                p = self.successor[p]
+            self._draw_to(defender)
 
     def check_outs(self):
+        if self.deck.left:
+            return
         for i, hand in enumerate(self.hands):
-            if i not in self.out and not hand and not self.deck.has_cards():
+            if not hand and not self.out_mask >> i & 1:
                 self.out.append(i)
+                self.out_mask |= 1 << i
+                self._link_seats()
                 if len(self.out) + 1 == self.number_of_players:
-                    for j in range(self.number_of_players):
-                        if j not in self.out:
-                            self.durak = j
-                            return
+                    self.durak = self.successor[i]
+                    return
 
 class Player:
-    def __init__(self, name):
+    # players that decide through the bitboard card index can only play its deck
+    needs_card_index = False
+
+    def __init__(self, name, rng=random):
         self.name = name
+        self.rng = rng
+        self.controller = None
 
     def decide_attack(self, _game_state, _idx):
         return None
@@ -305,24 +588,25 @@ class Player:
 
 class BotPlayer(Player):
     def decide_attack(self, game_state, idx):
-        return random.choice(game_state.legal_attacks(idx))
+        return self.rng.choice(game_state.legal_attacks(idx))
 
     def decide_defense(self, game_state):
-        return random.choice(game_state.legal_defenses())
+        return game_state.legal_defense_at(self.rng.randrange(game_state.count_legal_defenses()))
 
     def decide_pickup(self, game_state):
-        return random.choice(game_state.legal_pickup())
+        return self.rng.choice(game_state.legal_pickup())
 
 class HumanPlayer(Player):
     def decide_attack(self, game_state, idx):
         print('           ATTACK')
         print(f'  Play Field: {game_state.field}')
         print(f'Current Hand: {game_state.hands[idx]}')
-        print(f' Legal Plays: {game_state.legal_attacks(idx)}')
+        legal = game_state.legal_attacks(idx)
+        print(f' Legal Plays: {legal}')
         print('Input cards space separated (e.g. "AS AH")')
         print('To wait, simply press enter.')
         attack = None
-        while attack not in game_state.legal_attacks(idx):
+        while attack not in legal:
             request = input('What card(s) to play? ').upper().split(' ')
             if request == ['']:
                 return None
@@ -385,95 +669,204 @@ class HumanPlayer(Player):
                         return pickup
 
 class GameController:
-    def __init__(self, *players: list[Player]):
-        self.game_state = GameState(len(players))
+    def __init__(self, *players: list[Player], game_state=None, events=None, observe=False,
+                 rules=None, beliefs=False):
+        self.game_state = game_state if game_state is not None else GameState(len(players),
+                                                                               rules=rules)
+        if events is None and self.game_state.events is NULL_SINK and \
+                any(isinstance(player, HumanPlayer) for player in players):
+            # a person at the table needs to see what the other seats did
+            events = PrintSink()
+        if events is not None:
+            self.game_state.events = events
+        if observe or beliefs or any(player.needs_card_index for player in players):
+            from bitboard import check_rules
+            check_rules(self.game_state.rules)
+        self.observations = None
+        if observe:
+            from observation import ObservationEncoder
+            self.observations = ObservationEncoder(len(players))
+            if self.game_state.events is NULL_SINK:
+                self.game_state.events = self.observations
+            else:
+                self.game_state.events = TeeSink(self.observations, self.game_state.events)
+        self.beliefs = None
+        if beliefs:
+            from belief import BeliefTracker
+            self.beliefs = BeliefTracker(len(players))
+            if self.game_state.events is NULL_SINK:
+                self.game_state.events = self.beliefs
+            else:
+                self.game_state.events = TeeSink(self.beliefs, self.game_state.events)
         self.phase = None
         self.players = players
+        for player in players:
+            player.controller = self
         self.special_state = None
         self.turns_since_action = 0
-
-    def play_game(self):
+        self.pending = None
+        self.defender = None
+        self.defended = False
+        self.attacked = False
+        self.next_attacker = None
+        self.attackers_left = 0
+
+    def use_rng(self, rng):
+        self.game_state.rng = rng
+        for player in self.players:
+            player.rng = rng
+
+    def play_game(self, rng=None):
+        if rng is not None:
+            self.use_rng(rng)
+        self.start_game()
+        while self.pending is not None:
+            self.apply(self.decide(*self.pending))
+
+    def run_game(self):
+        self.start_game()
+        while self.pending is not None:
+            self.apply((yield self.pending))
+
+    def decide(self, kind, idx):
+        player = self.players[idx]
+        if kind == 'attack':
+            return player.decide_attack(self.game_state, idx)
+        if kind == 'defense':
+            return player.decide_defense(self.game_state)
+        return player.decide_pickup(self.game_state)
+
+    def fork(self, game_state, players):
+        gc = GameController(*players, game_state=game_state)
+        gc.phase = self.phase
+        gc.special_state = self.special_state
+        gc.turns_since_action = self.turns_since_action
+        gc.pending = self.pending
+        gc.defender = self.defender
+        gc.defended = self.defended
+        gc.attacked = self.attacked
+        gc.next_attacker = self.next_attacker
+        gc.attackers_left = self.attackers_left
+        return gc
+
+    def start_game(self):
         self.game_state.reset()
-        while self.game_state.durak is None:
+        self.start_round()
+
+    def start_round(self):
+        gs = self.game_state
+        if gs.durak is None:
             self.phase = 0 # Initial attack
-            attacker = self.game_state.primary_attacker
-            defender = self.game_state.defender()
-            if attacker == defender:
-                self.game_state.durak = attacker
-                break
-            print(f'{self.game_state.hands}')
-            self.handle_attack(attacker)
-            self.turns_since_action = 0
-            while self.turns_since_action < 5:
-                self.phase = 1 # Defense
-                defended = self.handle_defense()
-                if defended == 'pass':
-                    defender = self.game_state.next_after(self.game_state.defender())
-                    print(self.game_state.defender())
-                    self.turns_since_action = 0
-                else:
-                    if defended:
-                        if not self.game_state.hands[defender] or defended == 'take':
-                            break
-                        self.turns_since_action = 0
-                    self.phase = 2 # Additional attacks
-                    p = self.game_state.next_after(defender)
-                    attacked = False
-                    for _ in range(len(self.game_state.hands)-len(self.game_state.out) - 1):
-                        attacked = self.handle_attack(p) or attacked
-                        p = self.game_state.next_after(p)
-                    if attacked:
-                        self.turns_since_action = 0
-                    if not attacked and not defended:
-                        self.turns_since_action += 1
-
-            discard_cap = 6 if self.game_state.discard else 5
-            defense_cap = min(discard_cap - sum(1 for _, d in
-                                                self.game_state.field.items() if d is not None), \
-                            sum(1 for _, d in self.game_state.field.items() if d is None))
-
-            if not self.game_state.hands[defender] or defense_cap == 0:
-                print(self.game_state.field)
-                self.game_state.beat()
-                self.special_state = 'beat'
+            attacker = gs.primary_attacker
+            self.defender = gs.defender()
+            if attacker != self.defender:
+                self.pending = ('attack', attacker)
+                return
+            gs.durak = attacker
+        self.pending = None
+        gs.events.emit('durak', player=gs.durak, name=self.players[gs.durak].name)
+
+    def apply(self, move):
+        kind, idx = self.pending
+        self.game_state.events.emit('decision', kind=kind, player=idx, move=move)
+        if kind == 'attack':
+            attacked = self.handle_attack(idx, move)
+            if self.phase == 0:
+                self.turns_since_action = 0
+                self.defense_turn()
+            elif self.phase == 2:
+                self.attacked = attacked or self.attacked
+                self.next_attacker = self.game_state.next_after(self.next_attacker)
+                self.attackers_left -= 1
+                self.additional_attack_turn()
             else:
-                self.phase = 3 # In chase
-                p = self.game_state.next_after(defender)
-                for _ in range(len(self.game_state.hands)-len(self.game_state.out) - 1):
-                    self.handle_attack(p)
-                    p = self.game_state.next_after(p)
-                print(self.game_state.field)
-                self.game_state.surrender(self.handle_pickup())
-                self.special_state = 'surrender'
-        print(f'durak is {self.players[self.game_state.durak].name}')
-
-    def handle_attack(self, idx):
-        attack = self.players[idx].decide_attack(self.game_state, idx)
+                self.next_attacker = self.game_state.next_after(self.next_attacker)
+                self.attackers_left -= 1
+                self.chase_turn()
+        elif kind == 'defense':
+            self.after_defense(self.handle_defense(move))
+        else:
+            self.game_state.surrender(self.handle_pickup(move))
+            self.special_state = 'surrender'
+            self.start_round()
+
+    def defense_turn(self):
+        if self.turns_since_action < 5:
+            self.phase = 1 # Defense
+            self.pending = ('defense', self.game_state.defender())
+        else:
+            self.end_round()
+
+    def after_defense(self, defended):
+        gs = self.game_state
+        if defended == 'pass':
+            self.defender = gs.next_after(gs.defender())
+            self.turns_since_action = 0
+            self.defense_turn()
+            return
+        if defended:
+            if not gs.hands[self.defender] or defended == 'take':
+                self.end_round()
+                return
+            self.turns_since_action = 0
+        self.phase = 2 # Additional attacks
+        self.defended = defended
+        self.attacked = False
+        self.next_attacker = gs.next_after(self.defender)
+        self.attackers_left = len(gs.hands) - len(gs.out) - 1
+        self.additional_attack_turn()
+
+    def additional_attack_turn(self):
+        if self.attackers_left > 0:
+            self.pending = ('attack', self.next_attacker)
+            return
+        if self.attacked:
+            self.turns_since_action = 0
+        if not self.attacked and not self.defended:
+            self.turns_since_action += 1
+        self.defense_turn()
+
+    def end_round(self):
+        gs = self.game_state
+        if not gs.hands[self.defender] or gs.defense_cap() == 0:
+            gs.events.emit('field', field=list(gs.field.items()))
+            gs.beat()
+            self.special_state = 'beat'
+            self.start_round()
+        else:
+            self.phase = 3 # In chase
+            self.next_attacker = gs.next_after(self.defender)
+            self.attackers_left = len(gs.hands) - len(gs.out) - 1
+            self.chase_turn()
+
+    def chase_turn(self):
+        if self.attackers_left > 0:
+            self.pending = ('attack', self.next_attacker)
+            return
+        self.game_state.events.emit('field', field=list(self.game_state.field.items()))
+        self.pending = ('pickup', self.game_state.defender())
+
+    def handle_attack(self, idx, attack):
         if attack is None:
             return False
         self.game_state.attack(idx, attack)
         return True
 
-    def handle_defense(self):
-        defense = self.players[self.game_state.defender()].decide_defense(self.game_state)
+    def handle_defense(self, defense):
         if defense is None:
             return False
         if defense == 'take':
             return 'take'
         if isinstance(defense, tuple):
             m, c = defense
-            if m == 'show':
-                self.game_state.pass_it_on(m, c)
-            elif m == 'play':
-                for card in c:
-                    self.game_state.pass_it_on(m, card)
+            self.game_state.pass_it_on(m, c)
             return 'pass'
         for a, d in defense:
             self.game_state.defend(a, d)
         return True
 
-    def handle_pickup(self):
-        return self.players[self.game_state.defender()].decide_pickup(self.game_state)
+    def handle_pickup(self, pickup):
+        return pickup
 
     def get_state(self, idx):
         hands = self.game_state.hands
@@ -481,10 +874,15 @@ class GameController:
         def adjusted_index(i):
             return (i-idx) % len(hands)
 
-        unknown_cards = self.game_state.deck.cards[1:]
-        for hand in hands[1:]:
+        revealed = self.game_state.deck.revealed
+        tuples = self.game_state.rules.tuples
+        def is_known(card, rel):
+            return revealed.get(card) == (idx + rel) % len(hands)
+
+        unknown_cards = self.game_state.deck.remaining()[1:]
+        for rel, hand in enumerate(hands[1:], 1):
             for card in hand:
-                if not card.revealed:
+                if not is_known(card, rel):
                     unknown_cards.append(card)
         match self.special_state:
             case 'surrender':
@@ -495,17 +893,18 @@ class GameController:
                 sp = None
         self.special_state = None
         state = {
-            'own_cards': [c.tuple() for c in hands[0]],
-            'field_cards': [((a.tuple(), adjusted_index(self.game_state.deck.revealed[a])),
-                             None if d is None else (d.tuple(), adjusted_index(
+            'own_cards': [tuples[c] for c in hands[0]],
+            'field_cards': [((tuples[a], adjusted_index(self.game_state.deck.revealed[a])),
+                             None if d is None else (tuples[d], adjusted_index(
                                                                 self.game_state.deck.revealed[d]
                                                                 )))
                             for a, d in self.game_state.field.items()],
-            'opponent_cards': [[c.tuple() if c.revealed else None for c in h] for h in hands[1:]],
-            'discarded_cards': [c.tuple() for c in self.game_state.discard],
-            'trump_card': self.game_state.trump.tuple() if self.game_state.deck.has_cards() \
+            'opponent_cards': [[tuples[c] if is_known(c, rel) else None for c in h]
+                               for rel, h in enumerate(hands[1:], 1)],
+            'discarded_cards': [tuples[c] for c in self.game_state.discard],
+            'trump_card': tuples[self.game_state.trump] if self.game_state.deck.has_cards() \
                           else None,
-            'unknown_cards': [c.tuple() for c in unknown_cards],
+            'unknown_cards': [tuples[c] for c in unknown_cards],
             'defender_index': adjusted_index(self.game_state.defender()),
             'phase': self.phase, # 0: inital attack, 1: defense, 2: additional attack, 
                                  # 3: in chase, 4: picking up
@@ -514,6 +913,9 @@ class GameController:
         }
         return state
 
+    def get_observation(self, idx):
+        return self.observations.arrays[idx]
+
 if __name__ == '__main__':
     gc = GameController(BotPlayer('Bot0'), BotPlayer('Bot1'))
     for _ in range(10000):
@@ -0,0 +1,177 @@
+import itertools
+import random
+
+import gymnasium as gym
+from gymnasium import spaces
+import numpy as np
+
+from bitboard import INDEX, NUM_CARDS, NUM_RANKS, NUM_SUITS, RANK, SUIT
+from durak import BotPlayer, GameController, Player
+from observation import observation_size
+
+# canonical action table: every move the agent can make has one fixed index
+SUIT_SUBSETS = 2 ** NUM_SUITS - 1
+WAIT = 0
+TAKE = 1
+ATTACK_BASE = 2
+PLAY_BASE = ATTACK_BASE + NUM_RANKS * SUIT_SUBSETS
+SHOW_BASE = PLAY_BASE + NUM_RANKS * SUIT_SUBSETS
+DEFEND_BASE = SHOW_BASE + NUM_CARDS
+PICKUP_BASE = DEFEND_BASE + NUM_CARDS * NUM_CARDS
+MAX_PICKUPS = 64
+NUM_ACTIONS = PICKUP_BASE + MAX_PICKUPS
+
+DECISIONS = ('attack', 'defense', 'pickup')
+
+def rank_set_index(cards):
+    suits = 0
+    for card in cards:
+        suits |= 1 << SUIT[INDEX[card]]
+    return RANK[INDEX[cards[0]]] * SUIT_SUBSETS + suits - 1
+
+def env_observation_size(number_of_players):
+    return observation_size(number_of_players) + number_of_players + 5 + len(DECISIONS)
+
+def encode_observation(controller, seat, kind, obs):
+    # encoder row for the seat, then defender (relative), phase, turns since action and decision kind
+    n = len(controller.players)
+    defender_offset = observation_size(n)
+    phase_offset = defender_offset + n
+    turns_offset = phase_offset + 4
+    decision_offset = turns_offset + 1
+    obs[:defender_offset] = controller.get_observation(seat)
+    obs[defender_offset:] = 0
+    defender = controller.game_state.defender()
+    if defender < n:
+        obs[defender_offset + (defender - seat) % n] = 1
+    if controller.phase is not None:
+        obs[phase_offset + controller.phase] = 1
+    obs[turns_offset] = controller.turns_since_action
+    if kind is not None:
+        obs[decision_offset + DECISIONS.index(kind)] = 1
+
+def action_index(game_state, kind, move):
+    # None for moves outside the table: defenses of several pairs at once, late pickups
+    if move is None:
+        return WAIT
+    if kind == 'attack':
+        return ATTACK_BASE + rank_set_index(move)
+    if kind == 'pickup':
+        cards = set(move)
+        for i, pickup in enumerate(game_state.legal_pickup()[:MAX_PICKUPS]):
+            if set(pickup) == cards:
+                return PICKUP_BASE + i
+        return None
+    if move == 'take':
+        return TAKE
+    if isinstance(move, tuple):
+        method, cards = move
+        if method == 'show':
+            return SHOW_BASE + INDEX[cards]
+        return PLAY_BASE + rank_set_index(cards)
+    if len(move) == 1:
+        a, d = move[0]
+        return DEFEND_BASE + INDEX[a] * NUM_CARDS + INDEX[d]
+    return None
+
+def action_moves(game_state, seat, kind):
+    # legal moves for the seat keyed by their index in the action table
+    gs = game_state
+    moves = {}
+    if kind == 'attack':
+        for attack in gs.legal_attacks(seat):
+            moves[WAIT if attack is None else ATTACK_BASE + rank_set_index(attack)] = attack
+    elif kind == 'defense':
+        if gs.durak is not None:
+            moves[TAKE] = 'take'
+        else:
+            moves[WAIT] = None
+            unbeaten = [a for a, d in gs.field.items() if d is None]
+            if unbeaten:
+                moves[TAKE] = 'take'
+            if gs.defense_cap() > 0:
+                for a in unbeaten:
+                    for d in gs.hands[seat]:
+                        if gs.can_beat(a, d):
+                            moves[DEFEND_BASE + INDEX[a] * NUM_CARDS + INDEX[d]] = [(a, d)]
+            cards = sorted(gs.passable_cards())
+            for r in range(len(cards)):
+                for combo in itertools.combinations(cards, r + 1):
+                    moves[PLAY_BASE + rank_set_index(combo)] = ('play', list(combo))
+            for card in cards:
+                if card.suit == gs.trump.suit:
+                    moves[SHOW_BASE + INDEX[card]] = ('show', card)
+    else:
+        for i, pickup in enumerate(gs.legal_pickup()[:MAX_PICKUPS]):
+            moves[PICKUP_BASE + i] = pickup
+    return moves
+
+class DurakEnv(gym.Env):
+    metadata = {'render_modes': []}
+
+    def __init__(self, number_of_players=2, opponents=None, seat=0):
+        if opponents is None:
+            opponents = [BotPlayer(f'Bot{i}') for i in range(number_of_players - 1)]
+        players = list(opponents)
+        players.insert(seat, Player('Agent'))
+        self.seat = seat
+        self.number_of_players = len(players)
+        self.controller = GameController(*players, observe=True)
+        self.controller.use_rng(random.Random())
+        self.game = None
+        self.request = None
+        self.moves = {}
+
+        obs_size = env_observation_size(self.number_of_players)
+        self.observation_space = spaces.Box(0, NUM_CARDS, shape=(obs_size,), dtype=np.float32)
+        self.action_space = spaces.Discrete(NUM_ACTIONS)
+        self.observation = np.zeros(obs_size, dtype=np.float32)
+        self.action_mask = np.zeros(NUM_ACTIONS, dtype=np.int8)
+
+    def reset(self, *, seed=None, options=None):
+        super().reset(seed=seed)
+        if seed is not None:
+            self.controller.use_rng(random.Random(seed))
+        self.game = self.controller.run_game()
+        self._advance(None, start=True)
+        return self.observation, self._info()
+
+    def step(self, action):
+        if not self.action_mask[action]:
+            raise ValueError(f'illegal action {action} for {self.request}')
+        terminated = self._advance(self.moves[action])
+        reward = 0.0
+        if terminated:
+            reward = -1.0 if self.controller.game_state.durak == self.seat else 1.0
+        return self.observation, reward, terminated, False, self._info()
+
+    def _info(self):
+        return {'action_mask': self.action_mask}
+
+    def _advance(self, move, start=False):
+        try:
+            request = next(self.game) if start else self.game.send(move)
+            while request[1] != self.seat:
+                request = self.game.send(self.controller.decide(*request))
+        except StopIteration:
+            self.request = None
+            self.moves = {}
+            self.action_mask.fill(0)
+            self._encode(None)
+            return True
+        self.request = request
+        self._legal_moves(request[0])
+        self._encode(request[0])
+        return False
+
+    def _legal_moves(self, kind):
+        self.moves = action_moves(self.controller.game_state, self.seat, kind)
+        self.action_mask.fill(0)
+        self.action_mask[list(self.moves)] = 1
+
+    def _encode(self, kind):
+        encode_observation(self.controller, self.seat, kind, self.observation)
+
+# observations and masks are reused buffers, which the passive checker warns about
+gym.register(id='Durak-v0', entry_point='durak_env:DurakEnv', max_episode_steps=1000,
+             disable_env_checker=True)
@@ -0,0 +1,239 @@
+import os
+import pickle
+import random
+import time
+
+from bitboard import NUM_CARDS, bits, move_key
+from canonical import mask_permutation
+from durak import BotPlayer, GameController, Player
+from ismcts import determinize, legal_moves
+
+CONTROLLER_FIELDS = ('phase', 'special_state', 'turns_since_action', 'pending', 'defender',
+                     'defended', 'attacked', 'next_attacker', 'attackers_left')
+# the controller fields each phase still reads, the rest are overwritten before use
+PHASE_FIELDS = ((),
+                ('turns_since_action', 'defender'),
+                ('turns_since_action', 'defender', 'defended', 'attacked', 'next_attacker',
+                 'attackers_left'),
+                ('defender', 'next_attacker', 'attackers_left'))
+
+ENDGAME_CARDS = 6
+
+def endgame_applies(game_state, max_cards=ENDGAME_CARDS):
+    # with the deck gone and two players left, every hidden card is in the other hand. The
+    # position graph grows quickly with the cards still in play, hence the budget
+    return (game_state.durak is None and not game_state.deck.has_cards()
+            and game_state.number_of_players - len(game_state.out) == 2
+            and len(game_state.rules.cards) - len(game_state.discard) <= max_cards)
+
+class EndgameSolver:
+    # Solves two-player endgames exactly over the bitboard engine with undo. A position's
+    # value is who ends up durak under perfect play. Results are memoized per position and
+    # can be kept on disk.
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self.memo = {}
+        self.signature = None
+        self.dirty = False
+
+    def _rules_signature(self, rules):
+        return 'canonical', NUM_CARDS, rules.pass_it_on, rules.bout_caps, rules.max_hand_size
+
+    def _load(self, signature):
+        self.signature = signature
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        with open(self.cache_path, 'rb') as f:
+            cached_signature, memo = pickle.load(f)
+        if cached_signature == signature:
+            self.memo.update(memo)
+
+    def save(self):
+        if self.cache_path is None or not self.dirty:
+            return
+        tmp = f'{self.cache_path}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((self.signature, self.memo), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.cache_path)
+        self.dirty = False
+
+    def choose(self, controller, kind, idx, moves, rng=random):
+        options = {move_key(m, kind): m for m in moves}
+        if len(options) == 1:
+            return moves[0]
+        durak, best = self.solve(controller, idx, rng)
+        if durak is None:
+            # two solvers would keep repeating a drawn position, so one of them has to break it
+            return rng.choice(moves)
+        return options[best]
+
+    def solve(self, controller, observer, rng=random):
+        # (durak under perfect play or None if it can be stalled forever, best move key)
+        signature = self._rules_signature(controller.game_state.rules)
+        if signature != self.signature:
+            self.memo.clear()
+            self._load(signature)
+        state = determinize(controller.game_state, observer, rng)
+        state.enable_undo()
+        players = [Player(f'Solver{i}') for i in range(len(controller.players))]
+        sim = controller.fork(state, players)
+        key, perm = self._key(sim)
+        durak, best = self._search(sim, key, perm)
+        return durak, perm.inverse().move_key(best)
+
+    def _key(self, sim):
+        # positions that differ by a swap of non-trump suits share a key, so keys and stored
+        # moves are in canonical suits; returns the key and the permutation into them
+        gs = sim.game_state
+        defender = gs.defender()
+        # field cards the defender passed in go back to them on a take
+        passed = 0
+        for a in bits(gs.attacks):
+            if gs.revealed[a] == defender:
+                passed |= 1 << a
+        perm = mask_permutation(gs.trump_suit,
+                                (*gs.hands, gs.attacks, gs.beaten, gs.defenses, passed))
+        mask = perm.mask
+        return (tuple(mask(hand) for hand in gs.hands), mask(gs.attacks), mask(gs.beaten),
+                mask(gs.defenses), mask(passed), gs.discard != 0, gs.primary_attacker, gs.out_mask,
+                sim.phase, sim.pending,
+                *(getattr(sim, name) for name in PHASE_FIELDS[sim.phase])), perm
+
+    def _search(self, sim, root, perm):
+        # Passing cards back and forth can repeat a position, so instead of a tree search the
+        # reachable positions are enumerated once and solved backwards from the finished games.
+        # Positions neither side can force end up drawn (None). Every solved position is exact
+        # whichever root it was reached from, so all of them go into the memo.
+        gs = sim.game_state
+        if root in self.memo:
+            return self.memo[root]
+        kind, mover = sim.pending
+        nodes = {root: (mover, [])}
+        stack = [(root, perm, kind, iter(legal_moves(gs, kind, mover)), None, None)]
+        while stack:
+            key, perm, kind, moves, depth, saved = stack[-1]
+            move = next(moves, stack)
+            if move is stack:
+                stack.pop()
+                if saved is not None:
+                    self._restore(sim, depth, saved)
+                continue
+            child_depth = len(gs.history)
+            child_saved = [getattr(sim, name) for name in CONTROLLER_FIELDS]
+            sim.apply(move)
+            edge = perm.move_key(move_key(move, kind)), None, gs.durak
+            if sim.pending is not None:
+                child, child_perm = self._key(sim)
+                edge = edge[0], child, None
+                if child not in nodes and child not in self.memo:
+                    child_kind, mover = sim.pending
+                    nodes[child] = mover, []
+                    nodes[key][1].append(edge)
+                    stack.append((child, child_perm, child_kind,
+                                  iter(legal_moves(gs, child_kind, mover)), child_depth, child_saved))
+                    continue
+            nodes[key][1].append(edge)
+            self._restore(sim, child_depth, child_saved)
+        return self._retrograde(nodes, root)
+
+    def _restore(self, sim, depth, saved):
+        gs = sim.game_state
+        while len(gs.history) > depth:
+            gs.undo()
+        for name, value in zip(CONTROLLER_FIELDS, saved):
+            setattr(sim, name, value)
+
+    def _retrograde(self, nodes, root):
+        durak = {}
+        order = {}
+        parents = {}
+        losing = {}
+        queue = []
+
+        def settle(key, value):
+            durak[key] = value
+            order[key] = len(queue)
+            queue.append(key)
+
+        def propagate(key, value):
+            if key in durak:
+                return
+            mover = nodes[key][0]
+            if value is not None and value != mover:
+                settle(key, value)
+            elif value == mover:
+                losing[key] -= 1
+                if losing[key] == 0:
+                    settle(key, mover)
+
+        for key, (_, edges) in nodes.items():
+            losing[key] = len(edges)
+        for key, (_, edges) in nodes.items():
+            for _, child, value in edges:
+                if child in nodes:
+                    parents.setdefault(child, []).append(key)
+                else:
+                    propagate(key, value if child is None else self.memo[child][0])
+        i = 0
+        while i < len(queue):
+            child = queue[i]
+            i += 1
+            for key in parents.get(child, ()):
+                propagate(key, durak[child])
+
+        # winners head for the position settled first, which is the closest finish
+        for key, (mover, edges) in nodes.items():
+            value = durak.get(key)
+            best = None
+            for move, child, child_value in edges:
+                if child is not None:
+                    child_value = durak.get(child) if child in nodes else self.memo[child][0]
+                score = 0 if child_value == mover else 1 if child_value is None else 2
+                rank = score, -order.get(child, -1) if score == 2 else 0
+                if best is None or rank > best[0]:
+                    best = rank, move
+            self.memo[key] = value, best[1]
+        self.dirty = True
+        return self.memo[root]
+
+class EndgamePlayer(BotPlayer):
+    # plays randomly until the endgame, then perfectly
+    needs_card_index = True
+
+    def __init__(self, name, solver=None, max_cards=ENDGAME_CARDS, rng=random):
+        super().__init__(name, rng)
+        self.solver = solver if solver is not None else EndgameSolver()
+        self.max_cards = max_cards
+
+    def decide_attack(self, game_state, idx):
+        if endgame_applies(game_state, self.max_cards):
+            return self.solver.choose(self.controller, 'attack', idx, game_state.legal_attacks(idx),
+                                      self.rng)
+        return super().decide_attack(game_state, idx)
+
+    def decide_defense(self, game_state):
+        if endgame_applies(game_state, self.max_cards):
+            return self.solver.choose(self.controller, 'defense', game_state.defender(),
+                                      game_state.legal_defenses(), self.rng)
+        return super().decide_defense(game_state)
+
+    def decide_pickup(self, game_state):
+        if endgame_applies(game_state, self.max_cards):
+            return self.solver.choose(self.controller, 'pickup', game_state.defender(),
+                                      game_state.legal_pickup(), self.rng)
+        return super().decide_pickup(game_state)
+
+if __name__ == '__main__':
+    solver = EndgameSolver('endgame.cache')
+    player = EndgamePlayer('Endgame', solver)
+    losses = 0
+    games = 500
+    start = time.perf_counter()
+    for game in range(games):
+        players = [player, BotPlayer('Random')] if game % 2 == 0 else [BotPlayer('Random'), player]
+        gc = GameController(*players)
+        gc.play_game(rng=random.Random(game))
+        losses += gc.players[gc.game_state.durak] is player
+    solver.save()
+    print(f'Endgame player was durak in {losses}/{games} games against a random bot '
+          f'({time.perf_counter() - start:.1f}s, {len(solver.memo)} solved positions)')
@@ -0,0 +1,59 @@
+from collections import deque
+import json
+
+MESSAGES = {
+    'trump': 'The chosen trump is: {card}',
+    'attack': '{player} attacks with {cards}',
+    'defend': '{player} defends {attack} with {defense}',
+    'pass': '{player} passes onto {target} by {method}ing {cards}',
+    'field': '{field}',
+    'beat': '{player} beat the allegations!',
+    'take_back': '{player} took back {card}',
+    'surrender': '{player} surrendered and picked up {picked_up}',
+    'durak': 'durak is {name}',
+}
+
+class EventSink:
+    def emit(self, event, **fields):
+        pass
+
+    def close(self):
+        pass
+
+class PrintSink(EventSink):
+    def emit(self, event, **fields):
+        if event in MESSAGES:
+            print(MESSAGES[event].format(**fields))
+
+class RingBufferSink(EventSink):
+    def __init__(self, capacity=4096):
+        self.events = deque(maxlen=capacity)
+
+    def emit(self, event, **fields):
+        self.events.append((event, fields))
+
+class JsonlSink(EventSink):
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def emit(self, event, **fields):
+        fields['event'] = event
+        self.file.write(json.dumps(fields, separators=(',', ':'), default=str))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+class TeeSink(EventSink):
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def emit(self, event, **fields):
+        for sink in self.sinks:
+            sink.emit(event, **fields)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+NULL_SINK = EventSink()
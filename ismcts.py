@@ -0,0 +1,278 @@
+from collections import OrderedDict
+import gc
+import math
+import random
+import time
+
+from bitboard import BEATS, INDEX, NUM_CARDS, SUIT, BitGameState, bits, move_key, to_mask
+from durak import BotPlayer, GameController, Player
+
+MASK_BYTES = (NUM_CARDS + 7) // 8
+DECISIONS = {'attack': 0, 'defense': 1, 'pickup': 2}
+
+_zobrist_rng = random.Random(0x5EED)
+
+def _mask_table():
+    keys = [_zobrist_rng.getrandbits(64) for _ in range(NUM_CARDS)]
+    table = []
+    for b in range(MASK_BYTES):
+        row = []
+        for value in range(256):
+            h = 0
+            for bit in range(8):
+                card = b * 8 + bit
+                if value >> bit & 1 and card < NUM_CARDS:
+                    h ^= keys[card]
+            row.append(h)
+        table.append(row)
+    return table
+
+# one table per card set (own hand, attacks, beaten, defenses, discard), hashed a byte at a time
+HAND_KEYS, ATTACK_KEYS, BEATEN_KEYS, DEFENSE_KEYS, DISCARD_KEYS = (_mask_table() for _ in range(5))
+SMALL_KEYS = [[_zobrist_rng.getrandbits(64) for _ in range(64)] for _ in range(17)]
+HAND_SIZE_SLOT = 0
+DECK_SLOT, PENDING_SLOT, ATTACKER_SLOT, PHASE_SLOT, TURNS_SLOT, LEFT_SLOT, TRUMP_SLOT = range(10, 17)
+# the cards of each seat's hand the observer has seen, one table per seat like the hand sizes
+KNOWN_KEYS = [_mask_table() for _ in range(10)]
+
+def zobrist_mask(table, mask):
+    h = 0
+    b = 0
+    while mask:
+        h ^= table[b][mask & 255]
+        mask >>= 8
+        b += 1
+    return h
+
+def info_set_key(gc, observer):
+    # everything the observer can see: own hand, public cards, the trump, opponent cards it has
+    # seen, counts and turn position
+    gs = gc.game_state
+    h = zobrist_mask(HAND_KEYS, gs.hands[observer]) ^ zobrist_mask(ATTACK_KEYS, gs.attacks) \
+        ^ zobrist_mask(BEATEN_KEYS, gs.beaten) ^ zobrist_mask(DEFENSE_KEYS, gs.defenses) \
+        ^ zobrist_mask(DISCARD_KEYS, gs.discard)
+    revealed = gs.revealed
+    for j, hand in enumerate(gs.hands):
+        h ^= SMALL_KEYS[HAND_SIZE_SLOT + j][hand.bit_count()]
+        if j != observer:
+            known = 0
+            for c in bits(hand):
+                if revealed[c] == j or c == gs.trump:
+                    known |= 1 << c
+            h ^= zobrist_mask(KNOWN_KEYS[j], known)
+    h ^= SMALL_KEYS[TRUMP_SLOT][gs.trump]
+    kind, idx = gc.pending
+    h ^= SMALL_KEYS[DECK_SLOT][len(gs.deck)]
+    h ^= SMALL_KEYS[PENDING_SLOT][DECISIONS[kind] * 8 + idx]
+    h ^= SMALL_KEYS[ATTACKER_SLOT][gs.primary_attacker]
+    h ^= SMALL_KEYS[PHASE_SLOT][gc.phase]
+    h ^= SMALL_KEYS[TURNS_SLOT][gc.turns_since_action]
+    h ^= SMALL_KEYS[LEFT_SLOT][gc.attackers_left]
+    return h
+
+def determinize(game_state, observer, rng, beliefs=None):
+    # beliefs: a BeliefTracker on the same game, to deal the hidden cards by its odds
+    gs = game_state
+    n = gs.number_of_players
+    revealed = gs.deck.revealed
+    trump = INDEX[gs.trump]
+
+    attacks = beaten = defenses = 0
+    cover = [None] * NUM_CARDS
+    for a, d in gs.field.items():
+        attacks |= 1 << INDEX[a]
+        if d is not None:
+            beaten |= 1 << INDEX[a]
+            defenses |= 1 << INDEX[d]
+            cover[INDEX[a]] = INDEX[d]
+    discard = to_mask(gs.discard)
+    if beliefs is not None:
+        hands, deck = beliefs.sample(observer, rng)
+    else:
+        hands, deck = _deal_uniformly(gs, observer, rng, attacks | defenses | discard)
+
+    state = BitGameState(n, rules=gs.rules)
+    state.rng = rng
+    state.deck = deck
+    state.hands = hands
+    state.trump = trump
+    state.trump_suit = SUIT[trump]
+    state.beats = BEATS[state.trump_suit]
+    state.discard = discard
+    state.attacks = attacks
+    state.beaten = beaten
+    state.defenses = defenses
+    state.cover = cover
+    for card, where in revealed.items():
+        state.revealed[INDEX[card]] = where
+    state.primary_attacker = gs.primary_attacker
+    state.out = list(gs.out)
+    for i in gs.out:
+        state.out_mask |= 1 << i
+    state.durak = gs.durak
+    return state
+
+def _deal_uniformly(gs, observer, rng, seen):
+    revealed = gs.deck.revealed
+    trump = INDEX[gs.trump]
+    if gs.deck.has_cards():
+        seen |= 1 << trump
+
+    known = []
+    hidden = []
+    for j, hand in enumerate(gs.hands):
+        if j == observer:
+            mask = to_mask(hand)
+        else:
+            mask = to_mask(c for c in hand if revealed.get(c) == j or c == gs.trump)
+        known.append(mask)
+        hidden.append(len(hand) - mask.bit_count())
+        seen |= mask
+
+    pool = [c for c in range(NUM_CARDS) if not seen >> c & 1]
+    rng.shuffle(pool)
+    hands = []
+    pos = 0
+    for j in range(gs.number_of_players):
+        mask = known[j]
+        for c in pool[pos:pos + hidden[j]]:
+            mask |= 1 << c
+        pos += hidden[j]
+        hands.append(mask)
+    deck = pool[pos:]
+    if gs.deck.has_cards():
+        deck.insert(0, trump)
+    return hands, deck
+
+def legal_moves(game_state, kind, idx):
+    if kind == 'attack':
+        return game_state.legal_attacks(idx)
+    if kind == 'defense':
+        return game_state.legal_defenses()
+    return game_state.legal_pickup()
+
+class TranspositionTable:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def node(self, key):
+        node = self.entries.get(key)
+        if node is None:
+            node = {}
+            self.entries[key] = node
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return node
+
+    def __len__(self):
+        return len(self.entries)
+
+class ISMCTSPlayer(Player):
+    needs_card_index = True
+
+    def __init__(self, name, iterations=None, time_limit=0.04, exploration=0.7,
+                 table_size=50_000, rng=random):
+        super().__init__(name, rng)
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.exploration = exploration
+        self.table = TranspositionTable(table_size)
+
+    def decide_attack(self, game_state, idx):
+        return self.search('attack', idx, game_state.legal_attacks(idx))
+
+    def decide_defense(self, game_state):
+        return self.search('defense', game_state.defender(), game_state.legal_defenses())
+
+    def decide_pickup(self, game_state):
+        return self.search('pickup', game_state.defender(), game_state.legal_pickup())
+
+    def search(self, kind, observer, moves):
+        options = {move_key(m, kind): m for m in moves}
+        if len(options) == 1:
+            return moves[0]
+        # a full collection over the table's nodes can take longer than the budget, so it is
+        # held off until the move is made
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return self._search(kind, observer, options)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _search(self, kind, observer, options):
+        rollout_players = [BotPlayer(f'Rollout{i}', self.rng)
+                           for i in range(len(self.controller.players))]
+        start = time.perf_counter()
+        deadline = None if self.time_limit is None else start + self.time_limit
+        root = None
+        done = 0
+        while True:
+            state = determinize(self.controller.game_state, observer, self.rng,
+                                self.controller.beliefs)
+            sim = self.controller.fork(state, rollout_players)
+            if root is None:
+                root = info_set_key(sim, observer)
+            self.iterate(sim, observer)
+            done += 1
+            if self.iterations is not None and done >= self.iterations:
+                break
+            if deadline is not None:
+                # stop unless one more iteration of the average cost still fits
+                now = time.perf_counter()
+                if now + (now - start) / done >= deadline:
+                    break
+
+        node = self.table.node(root)
+        best = max(options, key=lambda k: node[k][1] if k in node else -1)
+        return options[best]
+
+    def select(self, node, keys):
+        unvisited = []
+        for key in keys:
+            stats = node.get(key)
+            if stats is None:
+                stats = node[key] = [0.0, 0, 0]
+            stats[2] += 1
+            if not stats[1]:
+                unvisited.append(key)
+        if unvisited:
+            return self.rng.choice(unvisited), True
+        c = self.exploration
+        return max(keys, key=lambda k: node[k][0] / node[k][1]
+                   + c * math.sqrt(math.log(node[k][2]) / node[k][1])), False
+
+    def iterate(self, sim, observer):
+        path = []
+        expanded = False
+        while sim.pending is not None and not expanded:
+            kind, mover = sim.pending
+            moves = {move_key(m, kind): m for m in legal_moves(sim.game_state, kind, mover)}
+            node = self.table.node(info_set_key(sim, observer))
+            key, expanded = self.select(node, list(moves))
+            path.append((node, key, mover))
+            sim.apply(moves[key])
+
+        while sim.pending is not None:
+            sim.apply(sim.decide(*sim.pending))
+
+        durak = sim.game_state.durak
+        for node, key, mover in path:
+            stats = node[key]
+            stats[0] += 0.0 if mover == durak else 1.0
+            stats[1] += 1
+
+if __name__ == '__main__':
+    bot = ISMCTSPlayer('ISMCTS')
+    losses = 0
+    games = 50
+    for game in range(games):
+        players = [bot, BotPlayer('Random')] if game % 2 == 0 else [BotPlayer('Random'), bot]
+        controller = GameController(*players)
+        controller.play_game(rng=random.Random(game))
+        losses += controller.players[controller.game_state.durak] is bot
+    print(f'ISMCTS was durak in {losses}/{games} games against a random bot')
@@ -0,0 +1,160 @@
+from concurrent.futures import Future
+import queue
+import random
+import threading
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from durak import BotPlayer, GameController, Player
+from durak_env import NUM_ACTIONS, action_moves, encode_observation, env_observation_size
+
+class PolicyNetwork(nn.Module):
+    def __init__(self, number_of_players=2, hidden=256):
+        super().__init__()
+        self.layers = nn.Sequential(
+            nn.Linear(env_observation_size(number_of_players), hidden),
+            nn.ReLU(),
+            nn.Linear(hidden, hidden),
+            nn.ReLU(),
+            nn.Linear(hidden, NUM_ACTIONS),
+        )
+
+    def forward(self, observations):
+        return self.layers(observations)
+
+class InferenceServer:
+    # Batches policy requests from any number of games and threads into one forward pass.
+    # A batch is run once it holds max_batch_size requests or its oldest request has
+    # waited max_wait seconds. Each request resolves to the masked softmax over actions.
+    def __init__(self, model, max_batch_size=256, max_wait=0.002):
+        self.model = model.eval()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.SimpleQueue()
+        self.batches = 0
+        self.served = 0
+        # held while enqueueing, so nothing can land behind the stop sentinel
+        self.lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def submit(self, observation, mask):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('InferenceServer is closed')
+            self.requests.put((observation, mask, future))
+        return future
+
+    def _serve(self):
+        running = True
+        while running:
+            item = self.requests.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._run(batch)
+
+    def _run(self, batch):
+        try:
+            observations = torch.from_numpy(np.stack([obs for obs, _, _ in batch]))
+            masks = torch.from_numpy(np.stack([mask for _, mask, _ in batch])).bool()
+            with torch.inference_mode():
+                logits = self.model(observations)
+                probs = torch.softmax(logits.masked_fill(~masks, float('-inf')), dim=-1).numpy()
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.served += len(batch)
+        for (_, _, future), p in zip(batch, probs):
+            future.set_result(p)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.requests.put(None)
+        self.thread.join()
+
+class NeuralPlayer(Player):
+    # needs a GameController(..., observe=True) for its observations
+    needs_card_index = True
+
+    def __init__(self, name, server, greedy=False, rng=random):
+        super().__init__(name, rng)
+        self.server = server
+        self.greedy = greedy
+
+    def decide_attack(self, game_state, idx):
+        return self.decide('attack', game_state, idx)
+
+    def decide_defense(self, game_state):
+        return self.decide('defense', game_state, game_state.defender())
+
+    def decide_pickup(self, game_state):
+        return self.decide('pickup', game_state, game_state.defender())
+
+    def decide(self, kind, game_state, idx):
+        moves = action_moves(game_state, idx, kind)
+        if len(moves) == 1:
+            return next(iter(moves.values()))
+        if self.controller.observations is None:
+            raise ValueError('NeuralPlayer needs a GameController created with observe=True')
+        observation = np.empty(env_observation_size(len(self.controller.players)), dtype=np.float32)
+        encode_observation(self.controller, idx, kind, observation)
+        mask = np.zeros(NUM_ACTIONS, dtype=np.int8)
+        mask[list(moves)] = 1
+        probs = self.server.submit(observation, mask).result()
+        if self.greedy:
+            return moves[int(probs.argmax())]
+        action = int(np.searchsorted(np.cumsum(probs), self.rng.random() * probs.sum(), side='right'))
+        return moves.get(action, moves[int(probs.argmax())])
+
+def play_threaded(server, games, threads=8, number_of_players=2, seed=0):
+    # each thread plays its share of games, so their decisions share batches
+    duraks = [0] * number_of_players
+
+    def worker(start):
+        for game in range(start, games, threads):
+            players = [NeuralPlayer('Neural', server)] + \
+                      [BotPlayer(f'Bot{i}') for i in range(1, number_of_players)]
+            gc = GameController(*players, observe=True)
+            gc.play_game(rng=random.Random(seed + game))
+            duraks[gc.game_state.durak] += 1
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return duraks
+
+if __name__ == '__main__':
+    torch.set_num_threads(1)
+    server = InferenceServer(PolicyNetwork(), max_batch_size=64, max_wait=0.001)
+    start = time.perf_counter()
+    duraks = play_threaded(server, games=200, threads=16)
+    elapsed = time.perf_counter() - start
+    server.close()
+    print(f'{200 / elapsed:.1f} games/s, {server.served / max(server.batches, 1):.1f} requests '
+          f'per batch, durak counts {duraks}')
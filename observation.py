@@ -0,0 +1,171 @@
+import numpy as np
+
+from bitboard import INDEX, NUM_CARDS
+from events import EventSink
+
+HAND = 0
+UNBEATEN = NUM_CARDS
+BEATEN = 2 * NUM_CARDS
+DEFENSES = 3 * NUM_CARDS
+DISCARD = 4 * NUM_CARDS
+UNKNOWN = 5 * NUM_CARDS
+TRUMP = 6 * NUM_CARDS
+KNOWN = 7 * NUM_CARDS
+
+def observation_size(number_of_players):
+    return KNOWN + (number_of_players - 1) * NUM_CARDS + 2 * number_of_players
+
+class ObservationEncoder(EventSink):
+    # Per-player observation rows kept up to date from game events. Layout, with
+    # opponents in seat order after the observer:
+    #   hand | unbeaten | beaten | defenses | discard | unknown | trump |
+    #   known cards per opponent | hand sizes (self first) | hidden count per opponent | deck
+    def __init__(self, number_of_players):
+        n = number_of_players
+        self.number_of_players = n
+        self.size = observation_size(n)
+        self.arrays = np.zeros((n, self.size), dtype=np.float32)
+        self.known_counts = np.zeros((n, n), dtype=np.int64)
+        self.hand_sizes = [0] * n
+        self.field = []
+        self.trump = None
+        self.deck_size = 0
+
+        sizes = KNOWN + (n - 1) * NUM_CARDS
+        self.deck_col = sizes + 2 * n - 1
+        self.known_col = [[None if j == p else KNOWN + ((j - p) % n - 1) * NUM_CARDS
+                           for j in range(n)] for p in range(n)]
+        self.size_col = [[sizes + (j - p) % n for j in range(n)] for p in range(n)]
+        self.hidden_col = [[None if j == p else sizes + n + (j - p) % n - 1
+                            for j in range(n)] for p in range(n)]
+        self.handlers = {
+            'trump': self._on_trump,
+            'deal': self._on_deal,
+            'attack': self._on_attack,
+            'defend': self._on_defend,
+            'pass': self._on_pass,
+            'beat': self._on_beat,
+            'take_back': self._on_take_back,
+            'surrender': self._on_surrender,
+            'draw': self._on_draw,
+        }
+
+    def emit(self, event, **fields):
+        handler = self.handlers.get(event)
+        if handler is not None:
+            handler(**fields)
+
+    def _refresh_counts(self, j):
+        for p in range(self.number_of_players):
+            self.arrays[p, self.size_col[p][j]] = self.hand_sizes[j]
+            if p != j:
+                self.arrays[p, self.hidden_col[p][j]] = self.hand_sizes[j] - self.known_counts[p, j]
+
+    def _reveal(self, j, c):
+        for p in range(self.number_of_players):
+            if p != j and not self.arrays[p, self.known_col[p][j] + c]:
+                self.arrays[p, self.known_col[p][j] + c] = 1
+                self.arrays[p, UNKNOWN + c] = 0
+                self.known_counts[p, j] += 1
+
+    def _leave_hand(self, j, c):
+        for p in range(self.number_of_players):
+            if p == j:
+                self.arrays[p, HAND + c] = 0
+            elif self.arrays[p, self.known_col[p][j] + c]:
+                self.arrays[p, self.known_col[p][j] + c] = 0
+                self.known_counts[p, j] -= 1
+            else:
+                self.arrays[p, UNKNOWN + c] = 0
+        self.hand_sizes[j] -= 1
+
+    def _enter_hand_publicly(self, j, c):
+        self.arrays[j, HAND + c] = 1
+        self._reveal(j, c)
+        self.hand_sizes[j] += 1
+
+    def _clear_field(self):
+        for c in self.field:
+            self.arrays[:, UNBEATEN + c] = 0
+            self.arrays[:, BEATEN + c] = 0
+            self.arrays[:, DEFENSES + c] = 0
+        self.field = []
+
+    def _on_trump(self, card):
+        self.trump = INDEX[card]
+
+    def _on_deal(self, deck, hands):
+        self.arrays.fill(0)
+        self.known_counts.fill(0)
+        self.field = []
+        self.deck_size = len(deck)
+        self.hand_sizes = [len(h) for h in hands]
+        self.arrays[:, UNKNOWN:UNKNOWN + NUM_CARDS] = 1
+        self.arrays[:, TRUMP + self.trump] = 1
+        if deck:
+            self.arrays[:, UNKNOWN + self.trump] = 0
+        for j, hand in enumerate(hands):
+            for card in hand:
+                c = INDEX[card]
+                self.arrays[j, HAND + c] = 1
+                self.arrays[j, UNKNOWN + c] = 0
+                if c == self.trump:
+                    self._reveal(j, c)
+        for j in range(self.number_of_players):
+            self._refresh_counts(j)
+        self.arrays[:, self.deck_col] = self.deck_size
+
+    def _on_attack(self, player, cards):
+        for card in cards:
+            c = INDEX[card]
+            self._leave_hand(player, c)
+            self.arrays[:, UNBEATEN + c] = 1
+            self.field.append(c)
+        self._refresh_counts(player)
+
+    def _on_defend(self, player, attack, defense):
+        a, d = INDEX[attack], INDEX[defense]
+        self._leave_hand(player, d)
+        self.arrays[:, UNBEATEN + a] = 0
+        self.arrays[:, BEATEN + a] = 1
+        self.arrays[:, DEFENSES + d] = 1
+        self.field.append(d)
+        self._refresh_counts(player)
+
+    def _on_pass(self, player, target, method, cards):
+        if method == 'show':
+            self._reveal(player, INDEX[cards])
+        else:
+            for card in cards:
+                c = INDEX[card]
+                self._leave_hand(player, c)
+                self.arrays[:, UNBEATEN + c] = 1
+                self.field.append(c)
+        self._refresh_counts(player)
+
+    def _on_beat(self, player):
+        for c in self.field:
+            self.arrays[:, DISCARD + c] = 1
+        self._clear_field()
+
+    def _on_take_back(self, player, card):
+        self._enter_hand_publicly(player, INDEX[card])
+        self._refresh_counts(player)
+
+    def _on_surrender(self, player, pickup, picked_up):
+        for card in picked_up:
+            self._enter_hand_publicly(player, INDEX[card])
+        self._clear_field()
+        self._refresh_counts(player)
+
+    def _on_draw(self, player, cards):
+        for card in cards:
+            c = INDEX[card]
+            self.arrays[player, HAND + c] = 1
+            self.arrays[player, UNKNOWN + c] = 0
+            self.hand_sizes[player] += 1
+            if c == self.trump:
+                self._reveal(player, c)
+        self.deck_size -= len(cards)
+        self._refresh_counts(player)
+        self.arrays[:, self.deck_col] = self.deck_size
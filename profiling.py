@@ -0,0 +1,176 @@
+import argparse
+import json
+import random
+import time
+
+from durak import BotPlayer, GameController
+
+LATENCY_BUCKETS = [1e-6 * 2 ** i for i in range(24)]
+COUNT_BUCKETS = [2 ** i for i in range(12)]
+PHASES = ('attack', 'defense', 'additional_attack', 'chase')
+MUTATORS = ('attack', 'defend', 'pass_it_on', 'beat', 'surrender', 'draw_cards', 'check_outs')
+HANDLERS = ('handle_attack', 'handle_defense', 'handle_pickup', 'get_state')
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        lo, hi = 0, len(self.bounds)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value <= self.bounds[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.counts[lo] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + [float('inf')], self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+class Profiler:
+    # Opt-in instrumentation: attach() wraps a controller's handlers, decisions and its game
+    # state's mutators with timing on that instance only, so unprofiled games pay nothing.
+    def __init__(self, prefix='durak'):
+        self.prefix = prefix
+        self.metrics = {}
+
+    def histogram(self, name, bounds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.metrics.get(key)
+        if hist is None:
+            hist = self.metrics[key] = Histogram(bounds)
+        return hist
+
+    def attach(self, controller):
+        gs = controller.game_state
+        round_state = {'decisions': 0, 'start': time.perf_counter()}
+
+        for name in HANDLERS:
+            self._time(controller, name, self.histogram('engine_seconds', LATENCY_BUCKETS, method=name))
+        for name in MUTATORS:
+            self._time(gs, name, self.histogram('engine_seconds', LATENCY_BUCKETS, method=name))
+
+        decide = controller.decide
+        def timed_decide(kind, idx):
+            phase = 'pickup' if kind == 'pickup' else PHASES[controller.phase]
+            start = time.perf_counter()
+            move = decide(kind, idx)
+            self.histogram('decision_seconds', LATENCY_BUCKETS, phase=phase,
+                           player=str(idx)).observe(time.perf_counter() - start)
+            # counted after the timing so the decision does not find the move caches warm
+            self.histogram('legal_moves', COUNT_BUCKETS, kind=kind).observe(
+                _legal_move_count(gs, kind, idx))
+            round_state['decisions'] += 1
+            return move
+        controller.decide = timed_decide
+
+        start_game = controller.start_game
+        def timed_start_game():
+            round_state['decisions'] = 0
+            round_state['start'] = time.perf_counter()
+            start_game()
+        controller.start_game = timed_start_game
+
+        for name in ('beat', 'surrender'):
+            self._end_round(gs, name, round_state)
+
+    def detach(self, controller):
+        for name in HANDLERS + ('decide', 'start_game'):
+            controller.__dict__.pop(name, None)
+        for name in MUTATORS:
+            controller.game_state.__dict__.pop(name, None)
+
+    def _time(self, obj, name, hist):
+        method = getattr(obj, name)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            hist.observe(time.perf_counter() - start)
+            return result
+        setattr(obj, name, timed)
+
+    def _end_round(self, gs, name, round_state):
+        method = getattr(gs, name)
+        rounds = self.histogram('round_decisions', COUNT_BUCKETS)
+        seconds = self.histogram('round_seconds', LATENCY_BUCKETS)
+        def end_round(*args, **kwargs):
+            result = method(*args, **kwargs)
+            now = time.perf_counter()
+            rounds.observe(round_state['decisions'])
+            seconds.observe(now - round_state['start'])
+            round_state['decisions'] = 0
+            round_state['start'] = now
+            return result
+        setattr(gs, name, end_round)
+
+    def snapshot(self):
+        out = {}
+        for (name, labels), hist in sorted(self.metrics.items()):
+            out.setdefault(f'{self.prefix}_{name}', []).append({
+                'labels': dict(labels),
+                'buckets': [['+Inf' if b == float('inf') else b, c] for b, c in hist.cumulative()],
+                'sum': hist.sum,
+                'count': hist.count,
+            })
+        return out
+
+    def to_prometheus(self):
+        lines = []
+        for name, series in self.snapshot().items():
+            lines.append(f'# TYPE {name} histogram')
+            for s in series:
+                labels = ','.join(f'{k}="{v}"' for k, v in s['labels'].items())
+                sep = ',' if labels else ''
+                for bound, count in s['buckets']:
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{name}_sum{suffix} {s["sum"]}')
+                lines.append(f'{name}_count{suffix} {s["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+
+def _legal_move_count(game_state, kind, idx):
+    if kind == 'attack':
+        return len(game_state.legal_attacks(idx))
+    if kind == 'defense':
+        return game_state.count_legal_defenses()
+    return len(game_state.legal_pickup())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile bot games and export latency histograms')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default='profile.json')
+    parser.add_argument('--prometheus', default='profile.prom')
+    args = parser.parse_args()
+
+    profiler = Profiler()
+    gc = GameController(*(BotPlayer(f'Bot{i}') for i in range(args.players)))
+    profiler.attach(gc)
+    for game in range(args.games):
+        gc.play_game(rng=random.Random(args.seed + game))
+    profiler.write_json(args.json)
+    profiler.write_prometheus(args.prometheus)
+    for name, series in profiler.snapshot().items():
+        count = sum(s['count'] for s in series)
+        total = sum(s['sum'] for s in series)
+        print(f'{name:28} {count:9} observations, total {total:.4g}')
@@ -0,0 +1,166 @@
+import mmap
+import random
+import struct
+
+import numpy as np
+
+from bitboard import CARDS, INDEX, NUM_CARDS, to_cards, to_mask
+from durak import GameController, Player
+from events import EventSink
+
+# file: magic, then games back to back. game: header, the pre-deal deck as one byte per card
+# (index 0 is the trump, cards are dealt from the end), then fixed-width decision records
+FILE_MAGIC = b'DRKR\x01\x00\x00\x00'
+GAME_HEADER = struct.Struct('<QBBBxI') # seed, players, deck size, durak, records
+RECORD = struct.Struct('<BBBBQ12s') # kind, player, tag, pair count, card mask, defense pairs
+RECORD_DTYPE = np.dtype([('kind', 'u1'), ('player', 'u1'), ('tag', 'u1'), ('count', 'u1'),
+                         ('cards', '<u8'), ('pairs', 'u1', (12,))])
+
+KINDS = ('attack', 'defense', 'pickup')
+MOVE_NONE, MOVE_CARDS, MOVE_TAKE, MOVE_SHOW, MOVE_PLAY, MOVE_DEFEND = range(6)
+
+def _index(card):
+    # BitGameState moves already hold card indices and masks
+    return card if isinstance(card, int) else INDEX[card]
+
+def _mask(cards):
+    return cards if isinstance(cards, int) else to_mask(cards)
+
+def encode_move(move):
+    if move is None:
+        return MOVE_NONE, 0, 0, b''
+    if move == 'take':
+        return MOVE_TAKE, 0, 0, b''
+    if isinstance(move, tuple):
+        method, cards = move
+        if method == 'show':
+            return MOVE_SHOW, 0, 1 << _index(cards), b''
+        return MOVE_PLAY, 0, _mask(cards), b''
+    if isinstance(move, list) and move and isinstance(move[0], tuple):
+        pairs = bytes(_index(c) for pair in move for c in pair)
+        return MOVE_DEFEND, len(move), sum(1 << _index(d) for _, d in move), pairs
+    return MOVE_CARDS, 0, _mask(move), b''
+
+def decode_move(tag, count, cards, pairs):
+    if tag == MOVE_NONE:
+        return None
+    if tag == MOVE_TAKE:
+        return 'take'
+    if tag == MOVE_SHOW:
+        return 'show', CARDS[int(cards).bit_length() - 1]
+    if tag == MOVE_PLAY:
+        return 'play', to_cards(int(cards))
+    if tag == MOVE_DEFEND:
+        return [(CARDS[pairs[2 * i]], CARDS[pairs[2 * i + 1]]) for i in range(count)]
+    return to_cards(int(cards))
+
+class _DealOrder:
+    # stands in for the deck rng so that GameState.reset deals a recorded deck
+    def __init__(self, deck):
+        self.deck = deck
+
+    def shuffle(self, cards):
+        cards[:] = self.deck[1:] + self.deck[:1]
+
+class ReplayWriter(EventSink):
+    # Records every game played on the controller it is attached to. The seed is metadata
+    # only, set it before each game; replays use the recorded deal.
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+        self.seed = 0
+        self.number_of_players = 0
+        self.deal = b''
+        self.records = bytearray()
+
+    def emit(self, event, **fields):
+        if event == 'decision':
+            tag, count, cards, pairs = encode_move(fields['move'])
+            self.records += RECORD.pack(KINDS.index(fields['kind']), fields['player'],
+                                        tag, count, cards, pairs)
+        elif event == 'deal':
+            hands = fields['hands']
+            if len(fields['deck']) + sum(len(h) for h in hands) != NUM_CARDS:
+                raise ValueError(f'replays record the {NUM_CARDS}-card deck only')
+            dealt = [hands[i][r] for r in reversed(range(len(hands[0])))
+                     for i in reversed(range(len(hands)))]
+            self.number_of_players = len(hands)
+            self.deal = bytes(INDEX[c] for c in fields['deck'] + dealt)
+            self.records = bytearray()
+        elif event == 'durak':
+            self.file.write(GAME_HEADER.pack(self.seed, self.number_of_players, len(self.deal),
+                                             fields['player'], len(self.records) // RECORD.size))
+            self.file.write(self.deal)
+            self.file.write(self.records)
+
+    def close(self):
+        self.file.close()
+
+class ReplayReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f'{path} is not a replay file')
+        self.games = []
+        offset = len(FILE_MAGIC)
+        while offset < len(self.buffer):
+            header = GAME_HEADER.unpack_from(self.buffer, offset)
+            self.games.append((offset, header))
+            offset += GAME_HEADER.size + header[2] + header[4] * RECORD.size
+
+    def __len__(self):
+        return len(self.games)
+
+    def num_decisions(self):
+        return sum(header[4] for _, header in self.games)
+
+    def header(self, game):
+        seed, players, deck_size, durak, count = self.games[game][1]
+        return {'seed': seed, 'number_of_players': players, 'deck_size': deck_size,
+                'durak': durak, 'decisions': count}
+
+    def deal(self, game):
+        offset, header = self.games[game]
+        start = offset + GAME_HEADER.size
+        return [CARDS[c] for c in self.buffer[start:start + header[2]]]
+
+    def records(self, game):
+        # zero-copy view of the decision records
+        offset, header = self.games[game]
+        return np.frombuffer(self.buffer, RECORD_DTYPE, header[4],
+                             offset + GAME_HEADER.size + header[2])
+
+    def moves(self, game):
+        for record in self.records(game):
+            yield (KINDS[record['kind']], int(record['player']),
+                   decode_move(record['tag'], record['count'], record['cards'], record['pairs']))
+
+    def replay(self, game, events=None, observe=False):
+        # yields (controller, kind, player, move) before each recorded move is applied
+        header = self.header(game)
+        if header['deck_size'] != NUM_CARDS:
+            raise ValueError(f'game {game} was recorded with a {header["deck_size"]}-card deck')
+        n = header['number_of_players']
+        gc = GameController(*(Player(f'Player{i}') for i in range(n)),
+                            events=events, observe=observe)
+        gc.game_state.rng = _DealOrder(self.deal(game))
+        gc.start_game()
+        for kind, player, move in self.moves(game):
+            if gc.pending != (kind, player):
+                raise ValueError(f'game {game} expected {gc.pending}, recorded {(kind, player)}')
+            yield gc, kind, player, move
+            gc.apply(move)
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+def record_games(path, players, seeds):
+    writer = ReplayWriter(path)
+    gc = GameController(*players, events=writer)
+    for seed in seeds:
+        writer.seed = seed
+        gc.play_game(rng=random.Random(seed))
+    writer.close()
@@ -0,0 +1,277 @@
+import argparse
+import multiprocessing as mp
+import os
+import random
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+from durak import GameController, Player
+from durak_env import NUM_ACTIONS, action_moves, encode_observation, env_observation_size
+
+class PolicyValueNetwork(nn.Module):
+    def __init__(self, number_of_players=2, hidden=256):
+        super().__init__()
+        self.trunk = nn.Sequential(
+            nn.Linear(env_observation_size(number_of_players), hidden),
+            nn.ReLU(),
+            nn.Linear(hidden, hidden),
+            nn.ReLU(),
+        )
+        self.policy = nn.Linear(hidden, NUM_ACTIONS)
+        self.value = nn.Linear(hidden, 1)
+
+    def forward(self, observations):
+        hidden = self.trunk(observations)
+        return self.policy(hidden), torch.tanh(self.value(hidden)).squeeze(-1)
+
+def sample_dtype(number_of_players):
+    # one row per decision; outcome is +1 for the deciding seat if it escaped, -1 if durak
+    return np.dtype([('observation', '<f4', (env_observation_size(number_of_players),)),
+                     ('mask', 'u1', (NUM_ACTIONS,)), ('action', '<i2'), ('outcome', '<f4')])
+
+class SharedReplayBuffer:
+    # A ring of fixed-size rows in shared memory. Actors append whole games and the learner
+    # samples batches; both copy under the lock, so no row is read half written.
+    def __init__(self, ctx, capacity, dtype):
+        self.capacity = capacity
+        self.dtype = dtype
+        self.memory = ctx.RawArray('b', capacity * dtype.itemsize)
+        self.lock = ctx.Lock()
+        self.written = ctx.RawValue('q', 0)
+        self._rows = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_rows'] = None
+        return state
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = np.frombuffer(self.memory, self.dtype, self.capacity)
+        return self._rows
+
+    def __len__(self):
+        return min(self.written.value, self.capacity)
+
+    def add(self, rows):
+        with self.lock:
+            start = self.written.value
+            self.rows[(start + np.arange(len(rows))) % self.capacity] = rows
+            self.written.value = start + len(rows)
+
+    def sample(self, batch_size, rng):
+        with self.lock:
+            size = len(self)
+            if size < batch_size:
+                return None
+            return self.rows[rng.integers(size, size=batch_size)]
+
+class SharedWeights:
+    # the learner's latest parameters as one flat float32 array plus a version counter
+    def __init__(self, ctx, model):
+        self.size = sum(t.numel() for t in model.state_dict().values())
+        self.memory = ctx.RawArray('f', self.size)
+        self.lock = ctx.Lock()
+        self.version = ctx.RawValue('q', -1)
+
+    def publish(self, model):
+        flat = torch.cat([t.detach().reshape(-1).float() for t in model.state_dict().values()])
+        with self.lock:
+            np.frombuffer(self.memory, np.float32)[:] = flat.numpy()
+            self.version.value += 1
+
+    def load(self, model, version=None):
+        # returns the version loaded; does nothing if the model already has the latest
+        if self.version.value == version:
+            return version
+        with self.lock:
+            flat = np.frombuffer(self.memory, np.float32).copy()
+            version = self.version.value
+        offset = 0
+        with torch.no_grad():
+            for tensor in model.state_dict().values():
+                n = tensor.numel()
+                tensor.copy_(torch.from_numpy(flat[offset:offset + n]).view_as(tensor))
+                offset += n
+        return version
+
+class SelfPlayGame:
+    def __init__(self, number_of_players, rng):
+        self.rng = rng
+        self.controller = GameController(*(Player(f'Seat{i}') for i in range(number_of_players)),
+                                         observe=True)
+        self.decisions = []
+
+    def start(self):
+        self.decisions = []
+        self.controller.use_rng(random.Random(self.rng.getrandbits(64)))
+        self.controller.start_game()
+
+    def advance(self):
+        # plays forced moves; returns the next real choice as (seat, kind, moves), None at the end
+        gc = self.controller
+        while gc.pending is not None:
+            kind, seat = gc.pending
+            moves = action_moves(gc.game_state, seat, kind)
+            if len(moves) > 1:
+                return seat, kind, moves
+            gc.apply(next(iter(moves.values())))
+        return None
+
+    def samples(self, dtype):
+        durak = self.controller.game_state.durak
+        rows = np.zeros(len(self.decisions), dtype)
+        for row, (observation, mask, action, seat) in zip(rows, self.decisions):
+            row['observation'] = observation
+            row['mask'] = mask
+            row['action'] = action
+            row['outcome'] = -1.0 if seat == durak else 1.0
+        return rows
+
+def actor(worker, buffer, weights, games_played, stop, number_of_players, games_at_once, seed):
+    # keeps games_at_once games going and decides all of their pending moves in one batch
+    torch.set_num_threads(1)
+    rng = random.Random(seed)
+    model = PolicyValueNetwork(number_of_players).eval()
+    version = weights.load(model)
+    size = env_observation_size(number_of_players)
+    observations = np.zeros((games_at_once, size), dtype=np.float32)
+    masks = np.zeros((games_at_once, NUM_ACTIONS), dtype=bool)
+    games = [SelfPlayGame(number_of_players, rng) for _ in range(games_at_once)]
+    for game in games:
+        game.start()
+
+    while not stop.is_set():
+        version = weights.load(model, version)
+        choices = []
+        for i, game in enumerate(games):
+            choice = game.advance()
+            while choice is None:
+                buffer.add(game.samples(buffer.dtype))
+                games_played[worker] += 1
+                game.start()
+                choice = game.advance()
+            seat, kind, moves = choice
+            encode_observation(game.controller, seat, kind, observations[i])
+            masks[i] = False
+            masks[i, list(moves)] = True
+            choices.append(choice)
+
+        with torch.inference_mode():
+            logits, _ = model(torch.from_numpy(observations))
+            logits = logits.masked_fill(~torch.from_numpy(masks), float('-inf'))
+            actions = torch.distributions.Categorical(logits=logits).sample().numpy()
+
+        for i, (game, (seat, kind, moves)) in enumerate(zip(games, choices)):
+            action = int(actions[i])
+            game.decisions.append((observations[i].copy(), masks[i].copy(), action, seat))
+            game.controller.apply(moves[action])
+
+def learner(buffer, weights, steps, stop, number_of_players, batch_size, lr, broadcast_every,
+            seed):
+    # policy gradient on the final outcome with the value head as baseline
+    torch.set_num_threads(1)
+    rng = np.random.default_rng(seed)
+    model = PolicyValueNetwork(number_of_players)
+    weights.load(model)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    while not stop.is_set():
+        batch = buffer.sample(batch_size, rng)
+        if batch is None:
+            time.sleep(0.01)
+            continue
+        # fields of packed rows are strided, torch wants them contiguous
+        observations = torch.from_numpy(np.ascontiguousarray(batch['observation']))
+        masks = torch.from_numpy(np.ascontiguousarray(batch['mask'])).bool()
+        actions = torch.from_numpy(batch['action'].astype(np.int64))
+        outcomes = torch.from_numpy(np.ascontiguousarray(batch['outcome']))
+
+        logits, values = model(observations)
+        log_probs = torch.log_softmax(logits.masked_fill(~masks, float('-inf')), dim=-1)
+        chosen = log_probs.gather(1, actions.unsqueeze(1)).squeeze(1)
+        advantage = outcomes - values.detach()
+        loss = -(advantage * chosen).mean() + nn.functional.mse_loss(values, outcomes)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        steps.value += 1
+        if steps.value % broadcast_every == 0:
+            weights.publish(model)
+    weights.publish(model)
+
+def train(seconds, actors=None, number_of_players=2, games_at_once=32, capacity=200_000,
+          batch_size=256, lr=3e-4, broadcast_every=50, seed=0, report_every=5.0, output=None):
+    # one learner process and an actor process for every other core
+    actors = actors or max(1, (os.cpu_count() or 1) - 1)
+    ctx = mp.get_context('spawn')
+    model = PolicyValueNetwork(number_of_players)
+    buffer = SharedReplayBuffer(ctx, capacity, sample_dtype(number_of_players))
+    weights = SharedWeights(ctx, model)
+    weights.publish(model)
+    games_played = ctx.RawArray('q', actors)
+    steps = ctx.RawValue('q', 0)
+    stop = ctx.Event()
+
+    processes = [ctx.Process(target=actor, args=(i, buffer, weights, games_played, stop,
+                                                 number_of_players, games_at_once, seed + i),
+                             daemon=True)
+                 for i in range(actors)]
+    processes.append(ctx.Process(target=learner, args=(buffer, weights, steps, stop,
+                                                       number_of_players, batch_size, lr,
+                                                       broadcast_every, seed + actors),
+                                 daemon=True))
+    for p in processes:
+        p.start()
+
+    start = last = time.perf_counter()
+    last_samples = last_trained = 0
+    while time.perf_counter() - start < seconds:
+        time.sleep(min(report_every, max(0.0, seconds - (time.perf_counter() - start))))
+        now = time.perf_counter()
+        samples = buffer.written.value
+        trained = steps.value * batch_size
+        print(f'{now - start:7.1f}s  {sum(games_played):7} games  '
+              f'{(samples - last_samples) / (now - last):8.0f} samples/s generated  '
+              f'{(trained - last_trained) / (now - last):8.0f} samples/s trained  '
+              f'weights v{weights.version.value}', flush=True)
+        last, last_samples, last_trained = now, samples, trained
+
+    stop.set()
+    for p in processes:
+        p.join()
+    elapsed = time.perf_counter() - start
+    weights.load(model)
+    if output is not None:
+        torch.save(model.state_dict(), output)
+    return {'games': sum(games_played), 'samples': buffer.written.value,
+            'steps': steps.value, 'seconds': elapsed,
+            'samples_per_second': buffer.written.value / elapsed,
+            'trained_per_second': steps.value * batch_size / elapsed}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Self-play training with actor processes, '
+                                                 'a shared replay buffer and one learner')
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--actors', type=int, default=None,
+                        help='default: one per core but the learner')
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--games-at-once', type=int, default=32, help='games each actor batches')
+    parser.add_argument('--capacity', type=int, default=200_000)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--lr', type=float, default=3e-4)
+    parser.add_argument('--broadcast-every', type=int, default=50,
+                        help='learner steps per weight update')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='selfplay.pt')
+    args = parser.parse_args()
+
+    result = train(args.seconds, args.actors, args.players, args.games_at_once, args.capacity,
+                   args.batch_size, args.lr, args.broadcast_every, args.seed, output=args.output)
+    print(f'{result["games"]} games, {result["samples"]} samples in {result["seconds"]:.1f}s: '
+          f'{result["samples_per_second"]:.0f} samples/s generated, '
+          f'{result["trained_per_second"]:.0f} samples/s trained')
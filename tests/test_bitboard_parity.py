@@ -0,0 +1,49 @@
+import random
+
+from bitboard import BitGameState, move_key, to_mask
+from durak import GameController, Player
+
+GAMES = 1000
+
+def _mask(hand):
+    return hand if isinstance(hand, int) else to_mask(hand)
+
+class ParityPlayer(Player):
+    # picks by the engine-independent move keys, so both engines see the same choices
+    def __init__(self, name, seed, trace):
+        super().__init__(name, random.Random(seed))
+        self.trace = trace
+
+    def choose(self, kind, game_state, moves):
+        keyed = {move_key(m, kind): m for m in moves}
+        keys = sorted(keyed)
+        key = keys[self.rng.randrange(len(keys))]
+        hands = tuple(_mask(h) for h in game_state.hands)
+        self.trace.append((kind, hands, game_state.primary_attacker, tuple(keys), key))
+        return keyed[key]
+
+    def decide_attack(self, game_state, idx):
+        return self.choose('attack', game_state, game_state.legal_attacks(idx))
+
+    def decide_defense(self, game_state):
+        return self.choose('defense', game_state, game_state.legal_defenses())
+
+    def decide_pickup(self, game_state):
+        return self.choose('pickup', game_state, game_state.legal_pickup())
+
+def _trace(seed, number_of_players, game_state):
+    trace = []
+    players = [ParityPlayer(f'Parity{i}', seed, trace) for i in range(number_of_players)]
+    controller = GameController(*players, game_state=game_state)
+    controller.game_state.rng = random.Random(seed)
+    controller.play_game()
+    trace.append(('durak', controller.game_state.durak))
+    return trace
+
+def test_bit_game_state_matches_reference():
+    for game in range(GAMES):
+        expected = _trace(game, 2, None)
+        actual = _trace(game, 2, BitGameState(2))
+        for step, (e, a) in enumerate(zip(expected, actual)):
+            assert e == a, f'game {game} diverged at step {step}'
+        assert len(expected) == len(actual), f'game {game} trace lengths differ'
@@ -0,0 +1,76 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import math
+import os
+import random
+
+from durak import BotPlayer, GameController
+
+def derive_seed(seed, game):
+    digest = hashlib.blake2b(f'{seed}:{game}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+@dataclass
+class PlayerStats:
+    name: str
+    games: int = 0
+    duraks: int = 0
+
+    @property
+    def durak_rate(self):
+        return self.duraks / self.games if self.games else 0.0
+
+    def confidence_interval(self, z=1.96):
+        # Wilson score interval, well behaved for rates near 0 or 1
+        if not self.games:
+            return 0.0, 1.0
+        n = self.games
+        p = self.durak_rate
+        centre = p + z * z / (2 * n)
+        margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        scale = 1 + z * z / n
+        return (centre - margin) / scale, (centre + margin) / scale
+
+def play_games(player_specs, seed, start, count, rotate_seats=True):
+    players = [cls(name) for cls, name in player_specs]
+    n = len(players)
+    duraks = [0] * n
+    for game in range(start, start + count):
+        shift = game % n if rotate_seats else 0
+        seating = players[shift:] + players[:shift]
+        gc = GameController(*seating)
+        gc.play_game(rng=random.Random(derive_seed(seed, game)))
+        if gc.game_state.durak is not None and gc.game_state.durak < n:
+            duraks[(gc.game_state.durak + shift) % n] += 1
+    return duraks
+
+def run_tournament(player_specs, games, seed=0, workers=None, chunk_size=250, rotate_seats=True):
+    workers = workers or os.cpu_count()
+    stats = [PlayerStats(name) for _, name in player_specs]
+    chunks = [(start, min(chunk_size, games - start)) for start in range(0, games, chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_games, player_specs, seed, start, count, rotate_seats)
+                   for start, count in chunks]
+        for future in futures:
+            for s, duraks in zip(stats, future.result()):
+                s.duraks += duraks
+    for s in stats:
+        s.games = games
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play a seeded Durak tournament across processes')
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=250)
+    args = parser.parse_args()
+
+    specs = [(BotPlayer, f'Bot{i}') for i in range(args.players)]
+    results = run_tournament(specs, args.games, args.seed, args.workers, args.chunk_size)
+    for s in results:
+        lo, hi = s.confidence_interval()
+        print(f'{s.name}: durak {s.duraks}/{s.games} = {s.durak_rate:.3%} (95% CI {lo:.3%}-{hi:.3%})')